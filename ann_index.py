@@ -0,0 +1,150 @@
+# ann_index.py
+
+import json
+import hashlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+IVF_CENTROIDS_FNAME = "ivf_centroids.npy"
+IVF_ORDER_FNAME = "ivf_order.npy"
+IVF_OFFSETS_FNAME = "ivf_offsets.npy"
+IVF_META_FNAME = "ivf_meta.json"
+ASSIGN_BLOCK_ROWS = 65536
+
+def ids_fingerprint(ids: List[str]) -> str:
+    # Dùng để phát hiện ANN cũ không còn khớp với vectors.npy (thêm/xóa/sắp xếp lại dòng)
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def _spherical_kmeans(sample: np.ndarray, n_lists: int, n_iter: int, rng) -> np.ndarray:
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Cụm rỗng → gieo lại từ một điểm ngẫu nhiên
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """
+    Inverted file index (IVF) chạy trên CPU: k-means cầu làm coarse quantizer,
+    mỗi dòng của vectors.npy thuộc về một list. Khi tìm kiếm chỉ quét `nprobe` list gần nhất.
+    - n_lists lớn / nprobe nhỏ → nhanh hơn, recall thấp hơn.
+    - nprobe = n_lists → tương đương tìm kiếm chính xác.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, fingerprint: str = ""):
+        self.centroids = centroids
+        self.order = order        # chỉ số dòng, sắp xếp theo list
+        self.offsets = offsets    # list i nằm trong order[offsets[i]:offsets[i + 1]]
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 10,
+              train_size: int = 100000, seed: int = 0, fingerprint: str = "") -> "IVFIndex":
+        n_rows = len(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(n_rows)))  # quy tắc kinh nghiệm ~4·√N
+        n_lists = min(n_lists, n_rows)
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n_rows, min(train_size, n_rows), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+        centroids = _spherical_kmeans(sample, n_lists, n_iter, rng)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(centroids, order, offsets, fingerprint)
+
+    def probe(self, q: np.ndarray, k: int, nprobe: int) -> np.ndarray:
+        ranked_lists = np.argsort(-(self.centroids @ q))
+        sizes = np.diff(self.offsets)[ranked_lists]
+        # Quét ít nhất nprobe list, mở rộng thêm nếu các list đó có ít hơn k dòng
+        enough = np.searchsorted(np.cumsum(sizes), k) + 1
+        probe = ranked_lists[:max(nprobe, min(enough, self.n_lists))]
+        rows = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in probe])
+        # Sắp xếp chỉ số để truy cập mmap tuần tự hơn
+        rows.sort()
+        return rows
+
+    def search(self, vectors: np.ndarray, q: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self.probe(q, k, nprobe)
+        if len(rows) == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    @staticmethod
+    def exists(persist_dir) -> bool:
+        return (Path(persist_dir) / IVF_META_FNAME).exists()
+
+    def save(self, persist_dir) -> None:
+        persist_dir = Path(persist_dir)
+        np.save(persist_dir / IVF_CENTROIDS_FNAME, self.centroids)
+        np.save(persist_dir / IVF_ORDER_FNAME, self.order)
+        np.save(persist_dir / IVF_OFFSETS_FNAME, self.offsets)
+        with open(persist_dir / IVF_META_FNAME, "w", encoding="utf-8") as f:
+            json.dump({"n_lists": self.n_lists, "fingerprint": self.fingerprint}, f)
+
+    @classmethod
+    def load(cls, persist_dir, mmap: bool = True) -> "IVFIndex":
+        persist_dir = Path(persist_dir)
+        with open(persist_dir / IVF_META_FNAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(persist_dir / IVF_CENTROIDS_FNAME),
+            np.load(persist_dir / IVF_ORDER_FNAME, mmap_mode="r" if mmap else None),
+            np.load(persist_dir / IVF_OFFSETS_FNAME),
+            meta["fingerprint"],
+        )
+
+    @staticmethod
+    def remove(persist_dir) -> None:
+        for fname in (IVF_CENTROIDS_FNAME, IVF_ORDER_FNAME, IVF_OFFSETS_FNAME, IVF_META_FNAME):
+            (Path(persist_dir) / fname).unlink(missing_ok=True)
+
+def recall_at_k(index: IVFIndex, vectors: np.ndarray, nprobe: int, k: int = 10,
+                n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> float:
+    """
+    So sánh top-k của IVF với tìm kiếm chính xác (brute-force) trên truy vấn giả lập:
+    lấy ngẫu nhiên các vector trong index rồi cộng nhiễu.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    hits = 0
+    for q in queries:
+        exact_scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            exact_scores[start:start + len(block)] = block @ q
+        kk = min(k, len(vectors))
+        exact = set(np.argpartition(-exact_scores, kk - 1)[:kk].tolist())
+        approx, _ = index.search(vectors, q, kk, nprobe)
+        hits += len(exact & set(approx.tolist()))
+    return hits / (len(queries) * min(k, len(vectors)))
@@ -0,0 +1,356 @@
+# benchmark.py
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+
+REPO_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(REPO_DIR))
+
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+STUB_EMBED_DIM = 768  # cùng số chiều với multilingual-e5-base để đo đúng chi phí lưu trữ/matmul
+
+WORDS = (
+    "thiết bị máy chủ rack nguồn điện cáp mạng quy trình kiểm tra vận hành bảo trì lắp đặt "
+    "triển khai datacenter phòng máy nhiệt độ làm mát điều hòa cảnh báo sự cố báo cáo trưởng ca "
+    "nhân viên đơn vị nội bộ phê duyệt tài sản nhãn vị trí tủ pdu ups pin ắc quy tải công suất "
+    "battery install cabinet power module bypass firmware inverter rectifier manual warning"
+).split()
+CODES = ["qtdc10", "qtdc11", "qtdc12", "Eaton 9130", "NX 4000", "PDU-A2", "UPS-B1"]
+BOILERPLATE = (
+    "Quy trình này áp dụng cho toàn bộ nhân viên vận hành Datacenter. Mọi thay đổi phải được "
+    "trưởng ca phê duyệt và ghi nhận vào hệ thống quản lý. Trong trường hợp có sự cố, nhân viên "
+    "phải báo cáo ngay cho bộ phận kỹ thuật và lập biên bản theo mẫu quy định. "
+) * 3
+
+# ===== Model giả lập: chạy offline trên CPU, kết quả xác định (deterministic) =====
+
+class StubEmbedding(BaseEmbedding):
+    """Embedding bag-of-words băm vào 768 chiều, đã chuẩn hóa L2."""
+
+    def __init__(self, **kwargs):
+        super().__init__(model_name="stub-hash-embedding", embed_batch_size=64, **kwargs)
+
+    def _vector(self, text):
+        vec = np.zeros(STUB_EMBED_DIM, dtype=np.float32)
+        for word in text.lower().split():
+            vec[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % STUB_EMBED_DIM] += 1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def _get_query_embedding(self, query):
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._vector(query)
+
+    def _get_text_embedding(self, text):
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts):
+        return [self._vector(t) for t in texts]
+
+class StubCrossEncoder:
+    """Điểm rerank = độ trùng từ giữa câu hỏi và đoạn văn."""
+
+    def predict(self, pairs, batch_size=16):
+        scores = []
+        for query, passage in pairs:
+            q, p = set(query.lower().split()), set(passage.lower().split())
+            scores.append(len(q & p) / (len(q) or 1))
+        return np.asarray(scores, dtype=np.float32)
+
+class StubTokenizer:
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(ids)
+
+class StubLLM(CustomLLM):
+    """LLM giả lập: trả về các từ đầu của ngữ cảnh, tùy chọn trễ cố định mỗi token."""
+
+    max_new_tokens: int = 64
+    token_delay: float = 0.0
+
+    @property
+    def metadata(self):
+        return LLMMetadata(context_window=4096, num_output=self.max_new_tokens, model_name="stub-llm")
+
+    def _tokens(self, prompt):
+        return ("Đáp: " + " ".join(prompt.split()[:self.max_new_tokens])).split(" ")
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        tokens = self._tokens(prompt)
+        time.sleep(self.token_delay * len(tokens))
+        return CompletionResponse(text=" ".join(tokens))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        text = ""
+        for i, token in enumerate(self._tokens(prompt)):
+            time.sleep(self.token_delay)
+            delta = token if i == 0 else " " + token
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+# ===== Corpus giả lập =====
+
+def make_document(rng, n_paragraphs, with_boilerplate):
+    paragraphs = [BOILERPLATE] if with_boilerplate else []
+    for _ in range(n_paragraphs):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(60, 120))]
+        words.insert(rng.randrange(len(words)), rng.choice(CODES))
+        paragraphs.append(" ".join(words).capitalize() + ".")
+    return "\n".join(paragraphs)
+
+def generate_corpus(raw_dir, n_docs, seed=0, paragraphs_per_doc=12):
+    rng = random.Random(seed)
+    for i in range(n_docs):
+        category = "manuals" if i % 3 == 0 else "procedures"
+        out = raw_dir / category / f"doc_{i:05d}.txt"
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(make_document(rng, paragraphs_per_doc, category == "procedures"), encoding="utf-8")
+
+def generate_questions(n, seed=1):
+    rng = random.Random(seed)
+    return [f"{rng.choice(['Quy trình', 'Cách', 'Hướng dẫn'])} {rng.choice(CODES)} "
+            f"{' '.join(rng.choice(WORDS) for _ in range(6))}?" for _ in range(n)]
+
+# ===== Đo đạc =====
+
+@contextmanager
+def workspace(root, name):
+    # Các script dùng đường dẫn tương đối (./data, ./logs) → chạy trong thư mục tạm riêng
+    path = Path(root) / name
+    (path / "logs").mkdir(parents=True, exist_ok=True)
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+def count_lines(path_glob_root, pattern):
+    return sum(1 for f in Path(path_glob_root).rglob(pattern) for _ in open(f, encoding="utf-8"))
+
+def run_ingest(n_docs):
+    import data_refine
+    import data_refine_cleaner
+    import data_indexing
+
+    generate_corpus(Path("data/rawdata"), n_docs)
+    timings = {}
+
+    start = time.perf_counter()
+    data_refine.main()
+    timings["refine"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data_refine_cleaner.main()
+    timings["clean"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data_indexing.main(embed_model=StubEmbedding())
+    timings["index"] = time.perf_counter() - start
+
+    with open(data_indexing.current_storage_dir() / data_indexing.NODE_MAP_FNAME, "r", encoding="utf-8") as f:
+        chunks = sum(len(ids) for ids in json.load(f).values())
+    total = sum(timings.values())
+    return {
+        "docs": n_docs,
+        "refine_chunks": count_lines("data/refine_data", "*.jsonl"),
+        "index_chunks": chunks,
+        "seconds": {k: round(v, 4) for k, v in timings.items()},
+        "docs_per_sec": {k: round(n_docs / v, 2) for k, v in timings.items()},
+        "chunks_per_sec": round(chunks / timings["index"], 2),
+        "end_to_end_docs_per_sec": round(n_docs / total, 2),
+    }
+
+def run_queries(n_queries, token_delay):
+    from config import Config
+    from chatbot import IDCChatbot
+    from reranker import Reranker
+
+    class BenchChatbot(IDCChatbot):
+        def _load_embed_model(self):
+            from llama_index.core.settings import Settings
+            Settings.embed_model = StubEmbedding()
+            return Settings.embed_model
+
+        def _load_llm(self, hf_token):
+            from chatbot import setup_prompt_builder
+            return StubLLM(token_delay=token_delay), StubTokenizer(), None, setup_prompt_builder(StubTokenizer())
+
+        def _load_reranker(self):
+            return Reranker(Config.RERANK_MODEL, batch_size=Config.RERANK_BATCH_SIZE,
+                            max_candidates=Config.FUSED_TOP_K,
+                            latency_budget_ms=None, model=StubCrossEncoder())
+
+    # Tắt cache câu trả lời để mọi câu hỏi đều đi hết pipeline. Tắt luôn thread theo dõi CURRENT:
+    # bot của corpus trước sẽ đọc ./data/storage của workspace sau (đường dẫn tương đối) và nạp lại giữa lúc đo
+    Config.CACHE_MAX_ENTRIES = 0
+    Config.INDEX_WATCH_SECONDS = 0
+    bot = BenchChatbot(hf_token="")
+    try:
+        bot.wait_until_ready()
+        startup = dict(bot.timings)
+
+        questions = generate_questions(n_queries)
+        bot.generate(bot.prepare(questions[0]))  # làm nóng (underthesea, mmap...)
+        bot.metrics.samples.clear()
+        bot.metrics.sums.clear()
+        bot.metrics.counts.clear()
+
+        start = time.perf_counter()
+        for question in questions:
+            turn = bot.prepare(question)
+            for _ in bot.generate_stream(turn):
+                pass
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.stop_watching()
+    return {
+        "queries": n_queries,
+        "queries_per_sec": round(n_queries / elapsed, 2),
+        "startup_seconds": {k: round(v, 4) for k, v in startup.items()},
+        "stages_ms": {stage: {k: (round(v * 1000, 3) if k != "count" else v) for k, v in stats.items()}
+                      for stage, stats in bot.metrics.summary().items()},
+    }
+
+def run_large_doc(size_mb):
+    """
+    Một tài liệu rất lớn (kiểu manual UPS/NX vài trăm trang) qua extract → split → save:
+    so sánh đường streaming (iter_documents) với đường gom hết vào list (extract_text_with_metadata).
+    """
+    from refine_utils import iter_documents, extract_text_with_metadata, save_documents
+
+    path = Path("large_manual.txt")
+    rng = random.Random(7)
+    with open(path, "w", encoding="utf-8") as f:
+        while f.tell() < size_mb * 1024 * 1024:
+            f.write(make_document(rng, 50, False) + "\n")
+    mb = path.stat().st_size / 1024 / 1024
+
+    result = {"size_mb": round(mb, 2)}
+    for name, docs_fn in (("streaming", iter_documents), ("materialized", extract_text_with_metadata)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        nodes = save_documents(docs_fn(path, "manual"), Path("large_out") / name, path.stem)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[name] = {"nodes": nodes, "seconds": round(elapsed, 4), "mb_per_sec": round(mb / elapsed, 2),
+                        "peak_mb": round(peak / 1024 / 1024, 2)}
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_benchmark(sizes, n_queries, token_delay, large_doc_mb=0):
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="idc-bench-") as root:
+        for n_docs in sizes:
+            print(f"\n📚 Corpus {n_docs} tài liệu")
+            with workspace(root, f"docs_{n_docs}"):
+                run = {"ingest": run_ingest(n_docs)}
+                run["query"] = run_queries(n_queries, token_delay)
+            results["runs"].append(run)
+            ingest, query = run["ingest"], run["query"]
+            print(f"   📥 Ingest: {ingest['end_to_end_docs_per_sec']} doc/s, {ingest['chunks_per_sec']} chunk/s (index)")
+            print(f"   🔎 Query: {query['queries_per_sec']} query/s, "
+                  f"total p50={query['stages_ms']['total']['p50']} ms p95={query['stages_ms']['total']['p95']} ms")
+        if large_doc_mb:
+            print(f"\n📕 Tài liệu lớn {large_doc_mb} MB")
+            with workspace(root, "large_doc"):
+                results["large_doc"] = large = run_large_doc(large_doc_mb)
+            for name in ("streaming", "materialized"):
+                print(f"   - {name:<13}: {large[name]['mb_per_sec']} MB/s, peak {large[name]['peak_mb']} MB "
+                      f"({large[name]['nodes']} node)")
+    return results
+
+def compare(old_path, new_path, threshold):
+    """So sánh hai file kết quả; trả về số chỉ số bị chậm đi quá `threshold` (tỉ lệ)."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"🔬 {old['commit']} → {new['commit']} (ngưỡng hồi quy {threshold:.0%})")
+    regressions = 0
+    old_runs = {r["ingest"]["docs"]: r for r in old["runs"]}
+    for run in new["runs"]:
+        docs = run["ingest"]["docs"]
+        if docs not in old_runs:
+            continue
+        base = old_runs[docs]
+        # Chỉ số thông lượng: càng cao càng tốt; độ trễ: càng thấp càng tốt
+        checks = [(f"ingest {k} doc/s", base["ingest"]["docs_per_sec"][k], v, True)
+                  for k, v in run["ingest"]["docs_per_sec"].items()]
+        checks.append(("query/s", base["query"]["queries_per_sec"], run["query"]["queries_per_sec"], True))
+        for stage, stats in run["query"]["stages_ms"].items():
+            if stage in base["query"]["stages_ms"]:
+                checks.append((f"{stage} p95 ms", base["query"]["stages_ms"][stage]["p95"], stats["p95"], False))
+        regressions += report_checks(f"{docs} docs", checks, threshold)
+    if "large_doc" in old and "large_doc" in new:
+        base, large = old["large_doc"]["streaming"], new["large_doc"]["streaming"]
+        checks = [("streaming MB/s", base["mb_per_sec"], large["mb_per_sec"], True),
+                  ("streaming peak MB", base["peak_mb"], large["peak_mb"], False)]
+        regressions += report_checks("large doc", checks, threshold)
+    return regressions
+
+def report_checks(label, checks, threshold):
+    regressions = 0
+    for name, before, after, higher_is_better in checks:
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = "❌" if worse > threshold else "  "
+        regressions += worse > threshold
+        print(f"{flag} [{label}] {name:<28} {before:>10.3f} → {after:>10.3f} ({change:+.1%})")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline cho pipeline ingest + truy vấn (model giả lập)")
+    parser.add_argument("--sizes", default="50,200,800", help="số tài liệu của từng corpus, cách nhau bởi dấu phẩy")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="trễ giả lập mỗi token của LLM")
+    parser.add_argument("--large-doc-mb", type=float, default=20, help="kích thước tài liệu lớn (0 = bỏ qua)")
+    parser.add_argument("--output", help="file JSON kết quả (mặc định logs/bench/bench-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="so sánh hai file kết quả")
+    parser.add_argument("--threshold", type=float, default=0.10, help="tỉ lệ chậm đi tính là hồi quy")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    results = run_benchmark([int(x) for x in args.sizes.split(",")], args.queries, args.token_delay_ms / 1000, args.large_doc_mb)
+    output = Path(args.output) if args.output else REPO_DIR / "logs" / "bench" / f"bench-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Đã ghi kết quả benchmark: {output}")
@@ -0,0 +1,114 @@
+# bm25_index.py
+
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from underthesea import word_tokenize
+
+BM25_FNAME = "bm25_index.json"
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+ALNUM_SPLIT_RE = re.compile(r"[^\W\d_]+|\d+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tách từ tiếng Việt bằng underthesea (giữ từ ghép như "quy_trình"),
+    đồng thời tách mã thiết bị/quy trình trộn chữ-số ("2qtdc10" → "qtdc", "10") để khớp chính xác.
+    """
+    tokens = []
+    for word in word_tokenize(text.lower()):
+        parts = WORD_RE.findall(word)
+        if not parts:
+            continue
+        tokens.append("_".join(parts))
+        for part in parts:
+            pieces = ALNUM_SPLIT_RE.findall(part)
+            if len(pieces) > 1:
+                tokens.extend(pieces)
+    return tokens
+
+class BM25Index:
+    """
+    Inverted index BM25 theo node_id, hỗ trợ thêm/xóa node để cập nhật tăng dần cùng data_indexing.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term → {node_id: tf}
+        self.doc_len: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, node_id: str, text: str) -> None:
+        if node_id in self.doc_len:
+            self.remove(node_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][node_id] = tf
+        self.doc_terms[node_id] = list(counts)
+        self.doc_len[node_id] = sum(counts.values())
+        self.total_len += self.doc_len[node_id]
+
+    def remove(self, node_id: str) -> None:
+        if node_id not in self.doc_len:
+            return
+        for term in self.doc_terms.pop(node_id, []):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(node_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(node_id)
+
+    def search(self, query: str, top_k: int = 10, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        # allowed: chỉ chấm điểm các node trong tập này (vd các node thuộc phân vùng được chọn)
+        n_docs = len(self.doc_len)
+        if n_docs == 0:
+            return []
+        avg_len = self.total_len / n_docs
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for node_id, tf in postings.items():
+                if allowed is not None and node_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[node_id] / avg_len)
+                scores[node_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+    @staticmethod
+    def exists(persist_dir) -> bool:
+        return (Path(persist_dir) / BM25_FNAME).exists()
+
+    def save(self, persist_dir) -> None:
+        path = Path(persist_dir) / BM25_FNAME
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "postings": self.postings, "doc_len": self.doc_len},
+                      f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, persist_dir) -> "BM25Index":
+        with open(Path(persist_dir) / BM25_FNAME, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.postings = defaultdict(dict, data["postings"])
+        index.doc_len = data["doc_len"]
+        index.total_len = sum(index.doc_len.values())
+        doc_terms = defaultdict(list)
+        for term, postings in index.postings.items():
+            for node_id in postings:
+                doc_terms[node_id].append(term)
+        index.doc_terms = dict(doc_terms)
+        return index
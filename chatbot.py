@@ -2,73 +2,551 @@
 
 import os
 import time
-import textwrap
-import torch
-from langdetect import detect
+import hashlib
+import threading
+from functools import partial
+from dataclasses import dataclass
 from contextlib import contextmanager
-from sentence_transformers import CrossEncoder
-from llama_index.core import StorageContext, load_index_from_storage
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
 
 from config import Config
-from load_model import load_model_and_tokenizer, setup_llm, setup_embed_model
-from clean_response import clean_response
+from load_model import load_model_and_tokenizer, setup_llm, setup_scheduler, setup_embed_model
+from prompt_builder import PromptBuilder
+from clean_response import clean_response, clean_stream
+from metrics import MetricsRegistry
+from query_router import QueryRouter
+import snapshots
 
-HF_TOKEN = os.getenv("HF_TOKEN") or (lambda: (_ for _ in ()).throw(ValueError("❌ Chưa có HF_TOKEN!")))()
+# torch, transformers, llama_index, underthesea... được import muộn bên trong các hàm load
+# để chúng chạy song song trên các thread warm-up thay vì chặn lúc import chatbot.py
 
 @contextmanager
 def timer():
+    # stats["first_token"] (thời điểm nhận token đầu) và stats["tokens"] do vòng lặp streaming điền vào
     start = time.time()
-    yield
-    print(f"⏱️ Thời gian phản hồi: {time.time() - start:.2f} giây")
-
-def setup_index(storage_dir):
-    storage_context = StorageContext.from_defaults(persist_dir=storage_dir)
-    return load_index_from_storage(storage_context)
-
-# Thiết lập
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"⚙️ Đang sử dụng thiết bị: {device.upper()} - {torch.cuda.get_device_name(0) if device == 'cuda' else 'CPU'}")
-
-try:
-    setup_embed_model()
-    model, tokenizer = load_model_and_tokenizer(HF_TOKEN)
-    llm = setup_llm(model, tokenizer)
-    index = setup_index(Config.STORAGE_DIR)
-    query_engine = index.as_query_engine(llm=llm, similarity_top_k=3)
-    reranker = CrossEncoder("BAAI/bge-reranker-base")
-except Exception as e:
-    print(f"❌ Lỗi khởi tạo: {e}")
-    exit(1)
-
-print("🤖 Chatbot IDC đã sẵn sàng. Gõ 'exit' để thoát.\n")
-
-# Vòng lặp chính
-while True:
-    user_input = input("👤 Bạn: ")
-    if user_input.lower() in ["exit", "quit"]:
-        print("👋 Tạm biệt!")
-        break
-
-    lang = detect(user_input)
-    print(f"🌐 Ngôn ngữ phát hiện: {lang}")
-    print("🤔 Chatbot đang suy nghĩ...")
-
-    with timer():
-        results = query_engine.retrieve(user_input)
-        pairs = [(user_input, r.node.text) for r in results]
-        scores = reranker.predict(pairs)
-        top_node = results[scores.argmax()].node.text
-
-        system_prompt = f"""
-        Bạn là trợ lý AI trả lời câu hỏi dựa trên tài liệu nội bộ. Trả lời chính xác theo dữ liệu.
-        Nếu không chắc chắn, hãy nói rõ là chưa tìm thấy trong dữ liệu.
-        Câu hỏi: {user_input}
+    stats = {}
+    yield stats
+    end = time.time()
+    line = f"⏱️ Thời gian phản hồi: {end - start:.2f} giây"
+    if "first_token" in stats:
+        line += f" | TTFT: {stats['first_token'] - start:.2f} giây"
+        if stats.get("tokens") and end > stats["first_token"]:
+            line += f" | {stats['tokens'] / (end - stats['first_token']):.1f} token/giây"
+    print(line)
+
+def load_storage_context(storage_dir):
+    from llama_index.core import StorageContext
+    from numpy_vector_store import NumpyVectorStore
+
+    # Storage mới: ma trận vectors.npy mở bằng mmap; storage cũ: vector store JSON mặc định
+    if NumpyVectorStore.exists(storage_dir):
+        vector_store = NumpyVectorStore.from_persist_dir(
+            storage_dir, mmap=True, nprobe=Config.ANN_NPROBE,
+            quantization=Config.VECTOR_QUANTIZATION, rescore_factor=Config.RESCORE_FACTOR)
+        return StorageContext.from_defaults(persist_dir=storage_dir, vector_store=vector_store)
+    return StorageContext.from_defaults(persist_dir=storage_dir)
+
+def setup_index(storage_dir, embed_model=None):
+    from llama_index.core import load_index_from_storage
+
+    storage_dir = snapshots.resolve_storage_dir(storage_dir)
+    return load_index_from_storage(load_storage_context(str(storage_dir)), embed_model=embed_model)
+
+def get_index_version(storage_dir):
+    # Storage dạng snapshot: tên snapshot trong CURRENT chính là phiên bản
+    version = snapshots.current_version(storage_dir)
+    if version is not None:
+        return version
+    # Layout phẳng cũ: file_cache.json được ghi lại sau mỗi lần data_indexing → hash của nó là phiên bản
+    cache_path = os.path.join(storage_dir, "file_cache.json")
+    if not os.path.exists(cache_path):
+        return ""
+    with open(cache_path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+NOT_FOUND_ANSWER = "Chưa tìm thấy thông tin này trong dữ liệu."
+
+def get_hf_token():
+    return os.getenv("HF_TOKEN") or (lambda: (_ for _ in ()).throw(ValueError("❌ Chưa có HF_TOKEN!")))()
+
+def setup_prompt_builder(tokenizer):
+    return PromptBuilder(tokenizer, context_window=Config.CONTEXT_WINDOW, max_new_tokens=Config.GEN_MAX_NEW_TOKENS,
+                         max_passages=Config.PROMPT_MAX_PASSAGES)
+
+@dataclass(frozen=True)
+class RetrievalBundle:
+    # Mọi thứ phụ thuộc vào một snapshot index; được thay nguyên khối khi CURRENT đổi
+    version: str
+    storage_dir: str
+    index: Any
+    retriever: Any
+    response_cache: Any
+    chunk_sources: dict
+
+class IDCChatbot:
+    """
+    Giữ các model (embedding, LLM, reranker) và index đã load, dùng chung cho CLI và HTTP server.
+    Các thành phần độc lập được load song song trên thread warm-up; truy cập thuộc tính
+    (llm, reranker, ...) sẽ chờ thành phần đó load xong.
+    Một lượt hỏi chia làm 2 bước để server chạy chúng trên các executor khác nhau:
+    prepare() (embed + cache + retrieve + rerank) và generate() (LLM).
+
+    Một thread nền theo dõi file CURRENT của storage: khi data_indexing publish snapshot mới,
+    index/retriever/BM25 được nạp lại rồi thay nguyên khối (RetrievalBundle), LLM/embedding/reranker
+    giữ nguyên. Mỗi lượt hỏi giữ tham chiếu tới bundle lúc bắt đầu nên không bị ảnh hưởng khi đổi giữa chừng.
+    """
+
+    def __init__(self, hf_token):
+        self.startup_started = time.perf_counter()
+        self.timings = {}
+        self.metrics = MetricsRegistry(
+            window=Config.METRICS_WINDOW,
+            jsonl_path=Config.METRICS_JSONL,
+            prom_path=Config.METRICS_PROM,
+            profile_dir=Config.PROFILE_DIR,
+            profile_sample_rate=Config.PROFILE_SAMPLE_RATE,
+        )
+        self.router = QueryRouter()
+        self.warmup = ThreadPoolExecutor(max_workers=4, thread_name_prefix="warmup")
+        self._embed = self._submit("embed_model", self._load_embed_model)
+        self._llm = self._submit("llm", self._load_llm, hf_token)
+        self._reranker = self._submit("reranker", self._load_reranker)
+        self._retrieval = self._submit("index", self._load_retrieval)
+        self.warmup.shutdown(wait=False)
+        self._stop_watch = threading.Event()
+        if Config.INDEX_WATCH_SECONDS:
+            threading.Thread(target=self._watch_index, name="index-watcher", daemon=True).start()
+
+    def _submit(self, name, fn, *args):
+        def timed():
+            start = time.perf_counter()
+            result = fn(*args)
+            self.timings[name] = time.perf_counter() - start
+            return result
+        return self.warmup.submit(timed)
+
+    def _load_embed_model(self):
+        return setup_embed_model()
+
+    def _load_llm(self, hf_token):
+        model, tokenizer = load_model_and_tokenizer(hf_token)
+        builder = setup_prompt_builder(tokenizer)
+        # KV của phần hướng dẫn cố định được tính ngay lúc load, các lượt hỏi chỉ prefill đoạn văn + câu hỏi
+        scheduler = setup_scheduler(model, tokenizer, builder.prefix_ids) if Config.GEN_BATCHING else None
+        return setup_llm(model, tokenizer), tokenizer, scheduler, builder
+
+    def _load_reranker(self):
+        import torch
+        from reranker import Reranker
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        return Reranker(
+            Config.RERANK_MODEL,
+            quantize=Config.RERANK_INT8 and device == "cpu",
+            batch_size=Config.RERANK_BATCH_SIZE,
+            max_candidates=Config.FUSED_TOP_K,
+            latency_budget_ms=Config.RERANK_BUDGET_MS,
+        )
+
+    def _load_retrieval(self, response_cache=None):
+        from llama_index.core import load_index_from_storage
+        from bm25_index import BM25Index
+        from retrieval import HybridRetriever
+        from response_cache import ResponseCache
+        from dedup import load_chunk_sources
+
+        storage_dir, version = snapshots.resolve(Config.STORAGE_DIR)
+        storage_dir = str(storage_dir)
+        version = version or get_index_version(storage_dir)
+        # Parse docstore/mmap vectors/BM25 song song với việc load embedding model,
+        # chỉ bước dựng VectorStoreIndex (rẻ) mới cần chờ embed model
+        storage_context = load_storage_context(storage_dir)
+        bm25 = BM25Index.load(storage_dir) if BM25Index.exists(storage_dir) else None
+        index = load_index_from_storage(storage_context, embed_model=self._embed.result())
+        retriever = HybridRetriever(index.as_retriever(similarity_top_k=Config.DENSE_TOP_K), bm25, index.docstore,
+                                    bm25_top_k=Config.BM25_TOP_K, fused_top_k=Config.FUSED_TOP_K,
+                                    index=index, dense_top_k=Config.DENSE_TOP_K,
+                                    partition_boost=Config.PARTITION_BOOST,
+                                    min_dense_ratio=Config.DENSE_MIN_SCORE_RATIO)
+        if response_cache is None:
+            response_cache = ResponseCache(
+                max_entries=Config.CACHE_MAX_ENTRIES,
+                ttl_seconds=Config.CACHE_TTL_SECONDS,
+                similarity_threshold=Config.CACHE_SIM_THRESHOLD,
+                version=version,
+            )
+        return RetrievalBundle(version, storage_dir, index, retriever, response_cache, load_chunk_sources(storage_dir))
+
+    def reload_index(self):
+        """Nạp snapshot mới nếu CURRENT đã đổi; trả về True nếu đã chuyển sang bundle mới."""
+        current = self.retrieval
+        if get_index_version(Config.STORAGE_DIR) == current.version:
+            return False
+        start = time.perf_counter()
+        bundle = self._load_retrieval(current.response_cache)
+        # Cache câu trả lời dùng chung giữa các bundle: đổi phiên bản (xóa sạch) trước khi publish bundle mới,
+        # để lượt hỏi trên bundle mới không đọc được câu trả lời của snapshot cũ. Lượt đang chạy trên bundle cũ
+        # thấy lệch phiên bản nên không ghi vào cache (_store_answer)
+        bundle.response_cache.set_version(bundle.version)
+        done = Future()
+        done.set_result(bundle)
+        self._retrieval = done  # gán thuộc tính là nguyên tử, lượt hỏi đang chạy vẫn giữ bundle cũ
+        print(f"🔄 Đã chuyển index {current.version} → {bundle.version} ({time.perf_counter() - start:.1f} giây)")
+        return True
+
+    def _watch_index(self):
+        while not self._stop_watch.wait(Config.INDEX_WATCH_SECONDS):
+            if not self._retrieval.done() or self._retrieval.exception() is not None:
+                continue
+            try:
+                self.reload_index()
+            except Exception as e:
+                # Snapshot hỏng/đang bị xóa → giữ bản đang phục vụ, lần poll sau thử lại
+                print(f"⚠️ Không nạp được index mới, giữ phiên bản cũ: {e}")
+
+    def stop_watching(self):
+        self._stop_watch.set()
+
+    @property
+    def embed_model(self):
+        return self._embed.result()
+
+    @property
+    def llm(self):
+        return self._llm.result()[0]
+
+    @property
+    def tokenizer(self):
+        return self._llm.result()[1]
+
+    @property
+    def scheduler(self):
+        # None → gọi thẳng HuggingFaceLLM, mỗi lần một prompt
+        return self._llm.result()[2]
+
+    @property
+    def prompt_builder(self):
+        return self._llm.result()[3]
+
+    @property
+    def reranker(self):
+        return self._reranker.result()
+
+    @property
+    def retrieval(self):
+        return self._retrieval.result()
+
+    @property
+    def index(self):
+        return self.retrieval.index
+
+    @property
+    def retriever(self):
+        return self.retrieval.retriever
+
+    @property
+    def response_cache(self):
+        return self.retrieval.response_cache
+
+    @property
+    def chunk_sources(self):
+        return self.retrieval.chunk_sources
+
+    def wait_until_retrieval_ready(self):
+        self._retrieval.result()
+
+    def wait_until_ready(self):
+        for future in (self._embed, self._llm, self._reranker, self._retrieval):
+            future.result()
+
+    def llm_ready(self):
+        return self._llm.done()
+
+    def fully_loaded(self):
+        return all(f.done() for f in (self._embed, self._llm, self._reranker, self._retrieval))
+
+    def check_failed(self):
+        # Đưa lỗi của thành phần load nền ra ngoài (vd tải model thất bại)
+        for future in (self._embed, self._llm, self._reranker, self._retrieval):
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def startup_report(self):
+        lines = [f"🚀 Thời gian khởi động ({time.perf_counter() - self.startup_started:.1f} giây từ lúc bắt đầu):"]
+        for name in ("embed_model", "index", "reranker", "llm"):
+            if name in self.timings:
+                lines.append(f"   - {name:<12}: {self.timings[name]:.1f} giây")
+            else:
+                lines.append(f"   - {name:<12}: ⏳ đang load...")
+        return "\n".join(lines)
+
+    def sources_for(self, node_id, bundle=None):
+        # File chứa node + các file có chunk gần trùng đã được gộp vào node này khi index
+        bundle = bundle or self.retrieval
+        node = bundle.index.docstore.get_node(node_id, raise_error=False)
+        own = [node.metadata["file_path"]] if node is not None and "file_path" in node.metadata else []
+        return own + [src for src in bundle.chunk_sources.get(node_id, []) if src not in own]
+
+    def is_node_current(self, node_id, node_hash, bundle=None):
+        node = (bundle or self.retrieval).index.docstore.get_node(node_id, raise_error=False)
+        return node is not None and node.hash == node_hash
+
+    def in_partitions(self, entry, partitions, bundle=None):
+        # Câu trả lời cache chỉ dùng cho câu hỏi restrict nếu node của nó thuộc một trong các phân vùng
+        node = (bundle or self.retrieval).index.docstore.get_node(entry.node_id, raise_error=False)
+        return node is not None and node.metadata.get("doc_type", "") in partitions
+
+    def route(self, question, partitions=None, mode=None, bundle=None):
         """
-        response = llm.complete(top_node + "\n" + system_prompt)
-        cleaned_text = clean_response(response)
-        wrapped_text = textwrap.fill(cleaned_text, width=100)
-
-        print("📄 Đoạn văn mô hình đang dùng để trả lời:")
-        print("-", top_node[:300])
-        prefix = "(Tiếng Việt)" if lang == "vi" else "(English)"
-        print("💬", prefix, wrapped_text)
\ No newline at end of file
+        Chọn phân vùng doc_type cho câu hỏi: dùng `partitions`/`mode` truyền vào nếu có, không thì hỏi
+        query router. Chỉ giữ phân vùng thật sự có trong index; index còn node chưa gắn doc_type
+        (build trước khi có phân vùng) thì restrict được hạ xuống boost để không bỏ sót các node đó.
+        """
+        if partitions is None:
+            if not Config.ROUTER_ENABLED:
+                return [], "none"
+            decision = self.router.route(question)
+            partitions, mode = decision.partitions, decision.mode
+        available = (bundle or self.retrieval).retriever.partitions
+        partitions = [p for p in partitions if p in available]
+        if not partitions:
+            return [], "none"
+        mode = mode or "restrict"
+        if mode == "restrict" and "" in available:
+            mode = "boost"
+        return partitions, mode
+
+    def prepare(self, question, trace=None, partitions=None, mode=None):
+        from llama_index.core import QueryBundle
+
+        trace = trace or self.metrics.start_turn(question)
+        # Cả lượt hỏi dùng một bundle, kể cả khi watcher đổi sang snapshot mới giữa chừng
+        bundle = self.retrieval
+        with trace.profiled("prepare"):
+            # Embed câu hỏi một lần, dùng chung cho semantic cache và vector search
+            with trace.span("query_embed"):
+                query_embedding = self.embed_model.get_query_embedding(question)
+            # Route trước khi tra cache: câu hỏi giới hạn phân vùng không được nhận câu trả lời từ phân vùng khác
+            with trace.span("route"):
+                partitions, mode = self.route(question, partitions, mode, bundle)
+            with trace.span("cache_lookup"):
+                cached = bundle.response_cache.get(
+                    question, query_embedding, partial(self.is_node_current, bundle=bundle),
+                    accept=partial(self.in_partitions, partitions=partitions, bundle=bundle) if mode == "restrict" else None)
+            if cached is not None:
+                return {"question": question, "context": cached.context, "answer": cached.answer,
+                        "sources": self.sources_for(cached.node_id, bundle), "cached": True, "trace": trace}
+
+            results = bundle.retriever.retrieve(QueryBundle(question, embedding=query_embedding), trace=trace,
+                                              partitions=partitions, mode=mode)
+            if not results:
+                # Index trống / phân vùng không có đoạn nào → trả lời ngay, không gọi LLM, không ghi cache
+                return {"question": question, "context": "", "passages": [], "answer": NOT_FOUND_ANSWER,
+                        "sources": [], "route": {"partitions": partitions, "mode": mode},
+                        "cached": False, "not_found": True, "trace": trace}
+            # Reranker còn đang load → giữ thứ tự first-stage để không chặn câu hỏi đầu tiên
+            reranked = self._reranker.done()
+            if reranked:
+                with trace.span("rerank"):
+                    results = self.reranker.rerank(question, results)
+            top_result = results[0]
+        return {
+            "question": question,
+            "context": top_result.node.text,
+            "passages": [r.node.text for r in results],
+            "node": top_result.node,
+            "sources": self.sources_for(top_result.node.node_id, bundle),
+            "route": {"partitions": partitions, "mode": mode},
+            "retrieval": bundle,
+            "query_embedding": query_embedding,
+            "reranked": reranked,
+            "cached": False,
+            "trace": trace,
+        }
+
+    def _store_answer(self, turn):
+        cache = turn["retrieval"].response_cache
+        # Câu trả lời từ snapshot đã bị thay trong lúc sinh → không ghi vào cache của phiên bản mới.
+        # max_new_tokens riêng nhỏ hơn mặc định → câu trả lời có thể bị cắt ngắn, không đưa cho người hỏi sau.
+        # Lượt chưa qua reranker (còn đang load) dựa trên đoạn văn kém hơn → cũng không cache
+        limit = turn.get("max_new_tokens")
+        truncated = limit is not None and limit < Config.GEN_MAX_NEW_TOKENS
+        if turn["retrieval"].version == cache.version and not truncated and turn["reranked"]:
+            cache.put(turn["question"], turn["answer"], turn["context"], turn["node"].node_id,
+                      turn["node"].hash, turn["query_embedding"])
+        turn["trace"].finish(cached=False)
+
+    def build_prompt(self, turn):
+        prompt = self.prompt_builder.build(turn["question"], turn["passages"], turn.get("max_new_tokens"))
+        # Các đoạn văn thực sự nằm trong prompt (ghi vào cache cùng câu trả lời)
+        turn["context"] = prompt.context
+        turn["prompt_tokens"] = {"prefix": len(prompt.prefix_ids), "suffix": len(prompt.suffix_ids)}
+        return prompt
+
+    def generate(self, turn):
+        trace = turn["trace"]
+        if turn["cached"] or turn.get("not_found"):
+            trace.finish(cached=turn["cached"])
+            return turn
+        with trace.profiled("generate"):
+            with trace.span("prompt_build"):
+                prompt = self.build_prompt(turn)
+            with trace.span("generate"):
+                if self.scheduler is not None:
+                    # Giữ request trong turn để cancel() dừng được dòng của nó trong batch
+                    turn["request"] = self.scheduler.submit(prompt, turn.get("max_new_tokens"))
+                    if turn.get("cancelled"):
+                        turn["request"].cancel()
+                    response = turn["request"].future.result()
+                else:
+                    response = self.llm.complete(prompt.text)
+            with trace.span("cleanup"):
+                turn["answer"] = clean_response(response)
+        if turn.get("cancelled"):
+            # Câu trả lời dở dang của lượt đã hủy không được ghi vào cache
+            trace.finish(cached=False, cancelled=True)
+            return turn
+        self._store_answer(turn)
+        return turn
+
+    def cancel(self, turn):
+        """Hủy một lượt đang chờ/đang sinh (client ngắt kết nối); an toàn khi gọi từ thread khác."""
+        turn["cancelled"] = True
+        request = turn.get("request")
+        if request is not None:
+            request.cancel()
+
+    def _llm_deltas(self, prompt, max_new_tokens=None):
+        # max_new_tokens riêng từng câu hỏi chỉ áp dụng khi đi qua scheduler
+        if self.scheduler is not None:
+            yield from self.scheduler.stream(prompt, max_new_tokens)
+            return
+        for response in self.llm.stream_complete(prompt.text):
+            yield response.delta or ""
+
+    def generate_stream(self, turn):
+        # Trả từng đoạn text đã làm sạch ngay khi LLM sinh ra; ghi cache khi stream kết thúc.
+        # Bỏ dở generator (client ngắt kết nối) sẽ hủy request tương ứng trong scheduler
+        trace = turn["trace"]
+        if turn["cached"] or turn.get("not_found"):
+            yield turn["answer"]
+            trace.finish(cached=turn["cached"])
+            return
+
+        with trace.profiled("generate"):
+            with trace.span("prompt_build"):
+                prompt = self.build_prompt(turn)
+
+            # Tách thời gian chờ LLM sinh token khỏi thời gian clean_stream xử lý
+            llm_seconds = 0.0
+
+            def timed_deltas():
+                nonlocal llm_seconds
+                stream = None
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        stream = stream or self._llm_deltas(prompt, turn.get("max_new_tokens"))
+                        delta = next(stream)
+                    except StopIteration:
+                        return
+                    finally:
+                        llm_seconds += time.perf_counter() - start
+                    yield delta
+
+            cleaned = clean_stream(timed_deltas())
+            pieces = []
+            stream_seconds = 0.0
+            while True:
+                start = time.perf_counter()
+                delta = next(cleaned, None)
+                stream_seconds += time.perf_counter() - start
+                if delta is None:
+                    break
+                if not pieces:
+                    trace.add("ttft", time.perf_counter() - trace.started)
+                pieces.append(delta)
+                yield delta
+            trace.add("generate", llm_seconds)
+            trace.add("cleanup", max(stream_seconds - llm_seconds, 0.0))
+
+        turn["answer"] = "".join(pieces).strip()
+        self._store_answer(turn)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def answer(self, question):
+        return self.generate(self.prepare(question))
+
+def main():
+    # Bắt đầu warm-up nền ngay, in thông tin thiết bị trong lúc chờ
+    try:
+        bot = IDCChatbot(get_hf_token())
+    except Exception as e:
+        print(f"❌ Lỗi khởi tạo: {e}")
+        exit(1)
+
+    import torch
+    from langdetect import detect
+
+    # Thiết lập
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"⚙️ Đang sử dụng thiết bị: {device.upper()} - {torch.cuda.get_device_name(0) if device == 'cuda' else 'CPU'}")
+
+    try:
+        bot.wait_until_retrieval_ready()
+    except Exception as e:
+        print(f"❌ Lỗi khởi tạo: {e}")
+        exit(1)
+
+    print(bot.startup_report())
+    print("🤖 Chatbot IDC đã sẵn sàng. Gõ 'exit' để thoát.\n")
+    reported = bot.fully_loaded()
+
+    # Vòng lặp chính
+    while True:
+        try:
+            bot.check_failed()
+        except Exception as e:
+            print(f"❌ Lỗi khởi tạo: {e}")
+            exit(1)
+        if not reported and bot.fully_loaded():
+            print(bot.startup_report())
+            reported = True
+
+        user_input = input("👤 Bạn: ")
+        if user_input.lower() in ["exit", "quit"]:
+            print(f"📊 Cache: {bot.response_cache.stats()}")
+            print(bot.metrics.report())
+            print("👋 Tạm biệt!")
+            break
+
+        trace = bot.metrics.start_turn(user_input)
+        with trace.span("lang_detect"):
+            lang = detect(user_input)
+        print(f"🌐 Ngôn ngữ phát hiện: {lang}")
+        print("🤔 Chatbot đang suy nghĩ...")
+
+        with timer() as stats:
+            turn = bot.prepare(user_input, trace)
+            if turn["cached"]:
+                print("⚡ Trả lời từ cache.")
+            elif not bot.llm_ready():
+                print("⏳ LLM vẫn đang load, câu trả lời sẽ bắt đầu khi load xong...")
+
+            print("📄 Đoạn văn mô hình đang dùng để trả lời:")
+            print("-", turn["context"][:300])
+            prefix = "(Tiếng Việt)" if lang == "vi" else "(English)"
+            print("💬", prefix, end=" ", flush=True)
+            for delta in bot.generate_stream(turn):
+                stats.setdefault("first_token", time.time())
+                print(delta, end="", flush=True)
+            print()
+            if not turn["cached"]:
+                stats["tokens"] = bot.count_tokens(turn["answer"])
+        print(f"🔎 {trace.breakdown()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,49 @@
 # clean_response.py
 
+PREFIXES = ["Đáp assistant", "assistant:", "Assistant:", "Đáp:", "Đáp"]
+
 def clean_response(response: str) -> str:
     raw_text = str(response).strip()
-    prefixes = ["Đáp assistant", "assistant:", "Assistant:", "Đáp:", "Đáp"]
-    for prefix in prefixes:
+    for prefix in PREFIXES:
         if raw_text.lower().startswith(prefix.lower()):
             return raw_text[len(prefix):].strip()
-    return raw_text
\ No newline at end of file
+    return raw_text
+
+def clean_stream(deltas):
+    """
+    Phiên bản streaming của clean_response: giữ lại phần đầu cho tới khi chắc chắn
+    nó không còn là một tiền tố cần bỏ, sau đó trả các đoạn tiếp theo ngay khi nhận được.
+    """
+    buffer = ""
+    deltas = iter(deltas)
+    for delta in deltas:
+        buffer += delta
+        head = buffer.lstrip().lower()
+        # Phần đầu vẫn có thể đang là tiền tố dở dang (vd "Đáp" trước "Đáp:") → chờ thêm
+        if not head or any(p.lower().startswith(head) and len(head) < len(p) for p in PREFIXES):
+            continue
+        text = buffer.lstrip()
+        for prefix in PREFIXES:
+            if text.lower().startswith(prefix.lower()):
+                text = text[len(prefix):]
+                break
+        text = text.lstrip()
+        if text:
+            yield text
+        break
+    else:
+        # Stream kết thúc khi chưa quyết định được → xử lý như bản không streaming
+        text = clean_response(buffer)
+        if text:
+            yield text
+        return
+
+    # Bỏ khoảng trắng đầu còn sót nếu tiền tố vừa kết thúc đúng ở ranh giới delta
+    pending_strip = not text
+    for delta in deltas:
+        if pending_strip:
+            delta = delta.lstrip()
+            if not delta:
+                continue
+            pending_strip = False
+        yield delta
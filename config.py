@@ -4,4 +4,36 @@ class Config:
     MODEL_REPO = "TheBloke/OpenHermes-2.5-Mistral-7B-AWQ"
     MODEL_DIR = "/content/models/OpenHermes-AWQ"
     STORAGE_DIR = "./data/storage"
-    EMBED_MODEL = "intfloat/multilingual-e5-base"
\ No newline at end of file
+    INDEX_WATCH_SECONDS = 5  # chu kỳ kiểm tra CURRENT để nạp snapshot index mới (0 → tắt hot reload)
+    EMBED_MODEL = "intfloat/multilingual-e5-base"
+    ANN_NPROBE = 8  # số list IVF quét mỗi truy vấn (chỉ dùng khi data_indexing đã build ANN)
+    VECTOR_QUANTIZATION = "none"  # "int8" (4× nhỏ hơn) | "binary" (32×): quét trên mã nén trong RAM, xem `python quantization.py`
+    RESCORE_FACTOR = 4            # shortlist = RESCORE_FACTOR × top-k dòng được chấm lại trên vector float
+    DENSE_TOP_K = 30   # số kết quả vector search
+    DENSE_MIN_SCORE_RATIO = 0.8   # bỏ kết quả vector có cosine < 80% kết quả tốt nhất trước khi fusion
+    BM25_TOP_K = 30    # số kết quả BM25
+    FUSED_TOP_K = 50   # số ứng viên sau RRF đưa vào CrossEncoder rerank
+    ROUTER_ENABLED = True  # định tuyến câu hỏi theo doc_type (manual/procedure) bằng từ khóa
+    PARTITION_BOOST = 0.5  # mode "boost": điểm node thuộc phân vùng được chọn nhân 1.5
+    CACHE_MAX_ENTRIES = 512       # số câu trả lời tối đa giữ trong cache (LRU)
+    CACHE_TTL_SECONDS = 3600      # thời gian sống của một câu trả lời trong cache
+    CACHE_SIM_THRESHOLD = 0.95    # cosine tối thiểu để dùng lại câu trả lời của câu hỏi tương tự
+    GEN_BATCHING = True           # gom câu hỏi đồng thời vào một lần model.generate (generation_scheduler.py)
+    GEN_MAX_BATCH_SIZE = 8        # số prompt tối đa mỗi batch, cũng là số thread LLM của server
+    GEN_BATCH_WINDOW_MS = 20      # thời gian chờ gom thêm prompt sau prompt đầu tiên của batch
+    GEN_MAX_NEW_TOKENS = 256      # trần max_new_tokens, request có thể xin ít hơn
+    CONTEXT_WINDOW = 4096         # prompt = hướng dẫn + đoạn văn + câu hỏi, luôn chừa chỗ cho max_new_tokens
+    PROMPT_MAX_PASSAGES = 5       # số đoạn văn đã rerank tối đa đưa vào prompt (ít hơn → prefill nhanh hơn)
+    RERANK_MODEL = "BAAI/bge-reranker-base"
+    RERANK_BATCH_SIZE = 16
+    RERANK_INT8 = False           # lượng tử hóa động int8 trên CPU, kiểm tra trước bằng `python reranker.py`
+    RERANK_BUDGET_MS = 400        # ngân sách thời gian rerank mỗi câu hỏi (None = chấm hết)
+    SERVER_HOST = "0.0.0.0"
+    SERVER_PORT = 8000
+    SERVER_QUEUE_SIZE = 32        # số câu hỏi chờ tối đa, vượt quá → 503
+    SERVER_WORKERS = 4            # số câu hỏi xử lý retrieve/rerank song song
+    METRICS_WINDOW = 2048                      # số mẫu gần nhất mỗi giai đoạn dùng để tính p50/p95/p99
+    METRICS_JSONL = "./logs/metrics.jsonl"     # mỗi lượt hỏi một dòng JSON với thời gian từng giai đoạn
+    METRICS_PROM = "./logs/metrics.prom"       # định dạng Prometheus text (textfile collector)
+    PROFILE_DIR = "./logs/profiles"
+    PROFILE_SAMPLE_RATE = 0.0                  # tỉ lệ lượt hỏi được chạy cProfile, vd 0.01
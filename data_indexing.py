@@ -1,78 +1,311 @@
 # data_indexing.py
 
 import os
-import time
-import hashlib
 import json
-import shutil
 from pathlib import Path
 from tqdm import tqdm
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, Document
+from llama_index.core import VectorStoreIndex, StorageContext, Document, load_index_from_storage
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.schema import MetadataMode
+from refine_utils import get_file_hash
+from embed_cache import EmbeddingCache, embed_texts
+from numpy_vector_store import NumpyVectorStore
+from ann_index import IVFIndex, ids_fingerprint, recall_at_k
+from quantization import MODES as QUANT_MODES, QuantizedCodes, format_report, quantization_report
+from bm25_index import BM25Index
+from dedup import ChunkDeduplicator
+import snapshots
 
 # Cài đặt
 REFINE_DIR = Path("data/refine_cleaner")  # ✅ Đã đổi sang refine_cleaner
-STORAGE_DIR = Path("data/storage")
-CACHE_PATH = STORAGE_DIR / "file_cache.json"
+STORAGE_DIR = Path("data/storage")  # CURRENT + snapshots/<version>/ (xem snapshots.py)
+CACHE_FNAME = "file_cache.json"
+NODE_MAP_FNAME = "node_map.json"  # file → danh sách node_id đã chèn vào index
+SNAPSHOT_KEEP = 3           # số snapshot giữ lại để chatbot chưa kịp chuyển vẫn đọc được bản cũ
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 64
+EMBED_CACHE_PATH = Path("data/embed_cache.sqlite")  # nằm ngoài storage để FORCE_REINDEX vẫn dùng lại được
 EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-base"
-FORCE_REINDEX = True
-
-# Chuẩn bị storage
-if FORCE_REINDEX and STORAGE_DIR.exists():
-    print("🧹 FORCE_REINDEX = True → Xóa storage cũ.")
-    shutil.rmtree(STORAGE_DIR)
-STORAGE_DIR.mkdir(parents=True, exist_ok=True)
-
-# Khởi tạo embedding model
-embed_model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL_NAME)
-parser = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-index = VectorStoreIndex([], embed_model=embed_model)
-
-# Hash cache
-if CACHE_PATH.exists() and not FORCE_REINDEX:
-    with open(CACHE_PATH, "r", encoding="utf-8") as f:
-        old_cache = json.load(f)
-else:
-    old_cache = {}
-
-new_cache = {}
-
-# Đọc file refine_cleaner
-all_files = list(REFINE_DIR.rglob("*.txt"))
-print(f"📁 Tổng số file cần xử lý từ refine_cleaner: {len(all_files)}")
-
-# Tiến hành indexing từng file với progress bar
-for file_path in tqdm(all_files, desc="🔍 Indexing file", ncols=100):
+EMBED_BATCH_SIZE = 64       # số chunk mỗi lần forward qua model
+INGEST_BATCH_SIZE = 1024    # số chunk gom từ nhiều file trước khi embed + chèn vào index
+VECTOR_DTYPE = "float32"    # "float16" để giảm một nửa dung lượng vectors.npy
+ANN_MIN_ROWS = 20000        # dưới ngưỡng này brute-force đã đủ nhanh, không build ANN
+ANN_N_LISTS = None          # None → tự chọn ~4·√N list
+ANN_NPROBE = 8              # nprobe dùng cho kiểm tra recall@k (chatbot dùng Config.ANN_NPROBE)
+ANN_RECALL_K = 10
+QUANT_RESCORE_FACTOR = 4    # shortlist dùng cho báo cáo recall của mã int8/binary (chatbot dùng Config.RESCORE_FACTOR)
+DEDUP_THRESHOLD = 0.85      # Jaccard (MinHash) để gộp chunk gần trùng; None → tắt
+FORCE_REINDEX = os.getenv("FORCE_REINDEX", "0") == "1"  # FORCE_REINDEX=1 → build lại toàn bộ
+
+def load_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_json(data: dict, path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def current_storage_dir() -> Path:
+    # Snapshot mà CURRENT trỏ tới; storage cũ (chưa có CURRENT) → chính STORAGE_DIR
+    return snapshots.resolve_storage_dir(STORAGE_DIR)
+
+def has_persisted_index(storage_dir: Path) -> bool:
+    return (
+        (storage_dir / "docstore.json").exists()
+        and (storage_dir / "index_store.json").exists()
+        and NumpyVectorStore.exists(storage_dir)
+    )
+
+def load_or_create_index(embed_model, force: bool):
+    # Delta mode chỉ hợp lệ khi có đủ index cũ + node map; thiếu một trong hai thì build lại từ đầu.
+    # Snapshot hiện tại chỉ được đọc, kết quả luôn ghi ra snapshot mới trong persist_all
+    source = current_storage_dir()
+    if not force and has_persisted_index(source) and (source / NODE_MAP_FNAME).exists():
+        # Load toàn bộ vào RAM (không mmap) vì sẽ thêm/xóa dòng rồi ghi ra snapshot mới
+        vector_store = NumpyVectorStore.from_persist_dir(source, mmap=False)
+        storage_context = StorageContext.from_defaults(persist_dir=str(source), vector_store=vector_store)
+        return load_index_from_storage(storage_context, embed_model=embed_model), False
+    if has_persisted_index(source):
+        print("🧹 Build lại toàn bộ → snapshot mới (snapshot đang phục vụ giữ nguyên tới khi chuyển CURRENT).")
+    storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore(dtype=VECTOR_DTYPE))
+    return VectorStoreIndex([], storage_context=storage_context, embed_model=embed_model), True
+
+def get_file_type(file_path: Path) -> str:
+    # Gán metadata dựa trên thư mục con
+    if len(file_path.parts) >= 3:
+        return file_path.parts[-2]  # "manuals", "procedures", etc.
+    return "unknown"
+
+def get_top_folder(file_path: Path, root: Path) -> str:
+    # Thư mục cấp đầu tiên dưới thư mục dữ liệu (manuals/ups/x.txt → "manuals"), như data_refine (rel_path.parts[0])
     try:
-        with open(file_path, "rb") as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        new_cache[str(file_path)] = file_hash
+        rel_path = file_path.relative_to(root)
+    except ValueError:
+        return "unknown"
+    return rel_path.parts[0] if len(rel_path.parts) >= 2 else "unknown"
 
-        if not FORCE_REINDEX and old_cache.get(str(file_path)) == file_hash:
+def get_doc_type(category: str) -> str:
+    # Cùng quy tắc với data_refine.get_file_category: thư mục cấp đầu chứa "manual" → manual, còn lại → procedure
+    return "manual" if "manual" in category.lower() else "procedure"
+
+def build_nodes(file_path: Path, parser):
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return build_nodes_from_text(file_path, text, parser)
+
+def build_nodes_from_text(file_path: Path, text: str, parser, root: Path = REFINE_DIR):
+    doc = Document(
+        id_=str(file_path),
+        text=text,
+        metadata={
+            "file_path": str(file_path),
+            "type": get_file_type(file_path),
+            "doc_type": get_doc_type(get_top_folder(file_path, root)),  # khóa phân vùng của vector store
+        },
+        # Đường dẫn không mang ngữ nghĩa, bỏ khỏi text embed để chunk trùng nội dung trùng cache key;
+        # doc_type chỉ dùng để lọc/phân vùng nên cũng không đưa vào text embed
+        excluded_embed_metadata_keys=["file_path", "doc_type"],
+    )
+    return parser.get_nodes_from_documents([doc])
+
+def load_or_create_bm25(index, rebuilt: bool) -> BM25Index:
+    if not rebuilt and BM25Index.exists(current_storage_dir()):
+        return BM25Index.load(current_storage_dir())
+    bm25 = BM25Index()
+    # Storage cũ chưa có BM25 → dựng lại từ các node đang có trong docstore
+    for node in tqdm(index.docstore.docs.values(), desc="🔤 Dựng BM25 từ docstore", ncols=100, disable=rebuilt):
+        bm25.add(node.node_id, node.get_content())
+    return bm25
+
+def load_or_create_dedup(index, rebuilt: bool):
+    if DEDUP_THRESHOLD is None:
+        return None
+    if not rebuilt and ChunkDeduplicator.exists(current_storage_dir()):
+        return ChunkDeduplicator.load(current_storage_dir())
+    dedup = ChunkDeduplicator(threshold=DEDUP_THRESHOLD)
+    # Storage cũ chưa có MinHash → nạp chữ ký các node đang có (không gộp lại những node đã chèn)
+    for node in tqdm(index.docstore.docs.values(), desc="🧬 Dựng MinHash từ docstore", ncols=100, disable=rebuilt):
+        dedup.add(node.node_id, dedup.signature(node.get_content()))
+    return dedup
+
+def remove_files(index, bm25: BM25Index, node_map: dict, file_keys: list, dedup=None):
+    """
+    Xóa node của các file; nếu một node chuẩn bị xóa đang đại diện cho chunk gần trùng của file khác
+    thì file đó mất nội dung → trả về để index lại (lan truyền tới khi ổn định).
+    """
+    node_ids, reindex = [], set()
+    queue, seen = list(file_keys), set()
+    while queue:
+        file_key = queue.pop()
+        if file_key in seen:
             continue
+        seen.add(file_key)
+        if dedup is not None:
+            dedup.remove_file_refs(file_key)
+            for orphan in dedup.remove_nodes(node_map.get(file_key, [])):
+                if orphan not in seen:
+                    reindex.add(orphan)
+                    queue.append(orphan)
+        node_ids += node_map.pop(file_key, [])
+    # Một lần delete_nodes cho mọi file: mỗi lần gọi vector store phải dồn lại cả ma trận
+    remove_nodes(index, bm25, node_ids)
+    return len(node_ids), reindex - set(file_keys)
+
+def remove_nodes(index, bm25: BM25Index, node_ids: list) -> None:
+    if node_ids:
+        index.delete_nodes(node_ids, delete_from_docstore=True)
+        for node_id in node_ids:
+            bm25.remove(node_id)
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
+def flush_nodes(index, bm25: BM25Index, embed_model, cache: EmbeddingCache, pending: list, node_map: dict,
+                dedup=None) -> None:
+    # pending: [(file_key, nodes)] gom từ nhiều file → embed một lượt theo lô cố định
+    if dedup is not None:
+        # Chunk gần trùng với node đã có (kể cả trong cùng lô) không embed, chỉ ghi tham chiếu nguồn
+        pending = [(file_key, dedup.dedup_nodes(file_key, nodes)) for file_key, nodes in pending]
+    all_nodes = [node for _, nodes in pending for node in nodes]
+    try:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in all_nodes]
+        for node, vector in zip(all_nodes, embed_texts(embed_model, cache, texts, EMBED_BATCH_SIZE)):
+            node.embedding = vector
+        index.insert_nodes(all_nodes)
+    except Exception:
+        if dedup is not None:
+            dedup.remove_nodes([node.node_id for node in all_nodes])
+            for file_key, _ in pending:
+                dedup.remove_file_refs(file_key)
+        raise
+    for node in all_nodes:
+        bm25.add(node.node_id, node.get_content())
+    for file_key, nodes in pending:
+        node_map[file_key] = [node.node_id for node in nodes]
+
+def load_previous_state(rebuilt: bool):
+    # file_cache + node_map của snapshot hiện tại (rỗng khi build lại từ đầu)
+    if rebuilt:
+        return {}, {}
+    source = current_storage_dir()
+    return load_json(source / CACHE_FNAME), load_json(source / NODE_MAP_FNAME)
+
+def build_ann_index(vector_store: NumpyVectorStore, storage_dir: Path) -> None:
+    if vector_store.size < ANN_MIN_ROWS:
+        IVFIndex.remove(storage_dir)
+        return
+    print(f"🧭 Đang build IVF ANN index cho {vector_store.size} vector...")
+    ann = IVFIndex.build(vector_store.vectors, n_lists=ANN_N_LISTS, fingerprint=ids_fingerprint(vector_store.ids))
+    ann.save(storage_dir)
+    recall = recall_at_k(ann, vector_store.vectors, nprobe=ANN_NPROBE, k=ANN_RECALL_K)
+    print(f"🎯 IVF: {ann.n_lists} list, nprobe={ANN_NPROBE} → recall@{ANN_RECALL_K} = {recall:.3f} so với tìm kiếm chính xác")
+
+def build_quantized_codes(vector_store: NumpyVectorStore, storage_dir: Path) -> None:
+    # Mã int8/binary rẻ để build (một lượt quét) → luôn build cả hai, chatbot chọn qua Config.VECTOR_QUANTIZATION
+    if vector_store.size == 0:
+        QuantizedCodes.remove(storage_dir)
+        return
+    fingerprint = ids_fingerprint(vector_store.ids)
+    codes_list = [QuantizedCodes.build(vector_store.vectors, mode, fingerprint) for mode in QUANT_MODES]
+    for codes in codes_list:
+        codes.save(storage_dir)
+    report = quantization_report(vector_store.vectors, codes_list, k=ANN_RECALL_K, rescore_factor=QUANT_RESCORE_FACTOR)
+    print(format_report(report, k=ANN_RECALL_K, rescore_factor=QUANT_RESCORE_FACTOR))
+
+def persist_all(index, bm25: BM25Index, file_cache: dict, node_map: dict, dedup=None, changed: bool = True) -> str:
+    # Ghi index, cache và node map vào snapshot mới, xong hết mới chuyển CURRENT sang snapshot đó
+    current = snapshots.current_version(STORAGE_DIR)
+    if not changed and current is not None:
+        # Không có gì thay đổi → giữ nguyên CURRENT, chatbot không phải nạp lại index
+        print(f"📸 Index không đổi, giữ snapshot {current}")
+        return current
+    staging = snapshots.begin_snapshot(STORAGE_DIR)
+    index.storage_context.persist(str(staging))
+    save_json(file_cache, staging / CACHE_FNAME)
+    save_json(node_map, staging / NODE_MAP_FNAME)
+    bm25.save(staging)
+    if dedup is not None:
+        dedup.save(staging)
+    build_ann_index(index.vector_store, staging)
+    build_quantized_codes(index.vector_store, staging)
+    version = snapshots.publish_snapshot(STORAGE_DIR, staging)
+    print(f"📸 Snapshot {version} → CURRENT")
+    flat = snapshots.remove_flat_layout(STORAGE_DIR)
+    if flat:
+        print(f"🗑️ Đã xóa {len(flat)} file của layout phẳng cũ trong {STORAGE_DIR}")
+    removed = snapshots.gc_snapshots(STORAGE_DIR, keep=SNAPSHOT_KEEP)
+    if removed:
+        print(f"🗑️ Đã xóa {len(removed)} snapshot cũ: {', '.join(removed)}")
+    return version
+
+def main(embed_model=None):
+    # embed_model truyền vào từ ngoài (vd model giả lập trong benchmark.py); mặc định dùng e5 qua HuggingFace
+    if embed_model is None:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        embed_model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE)
+    cache = EmbeddingCache(EMBED_CACHE_PATH, embed_model.model_name)
+    parser = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    index, rebuilt = load_or_create_index(embed_model, FORCE_REINDEX)
+    bm25 = load_or_create_bm25(index, rebuilt)
+    dedup = load_or_create_dedup(index, rebuilt)
+
+    old_cache, node_map = load_previous_state(rebuilt)
+    new_cache = {}
 
-        # Gán metadata dựa trên thư mục con
-        if len(file_path.parts) >= 3:
-            file_type = file_path.parts[-2]  # "manuals", "procedures", etc.
-        else:
-            file_type = "unknown"
+    # Đọc file refine_cleaner và so sánh hash với lần chạy trước
+    all_files = list(REFINE_DIR.rglob("*.txt"))
+    for file_path in all_files:
+        new_cache[str(file_path)] = get_file_hash(file_path)
 
-        doc = Document(text=text, metadata={"file_path": str(file_path), "type": file_type})
-        nodes = parser.get_nodes_from_documents([doc])
-        index.insert_nodes(nodes)
+    changed_files = [f for f in all_files if old_cache.get(str(f)) != new_cache[str(f)]]
+    removed_files = [key for key in node_map if key not in new_cache]
+
+    print(f"📁 Tổng số file trong refine_cleaner: {len(all_files)}")
+    print(f"🆕 File mới/thay đổi: {len(changed_files)} | 🗑️ File đã xóa: {len(removed_files)}")
+
+    # Xóa node cũ của file bị xóa hoặc bị sửa trước khi chèn lại
+    removed_nodes, reindex = remove_files(index, bm25, node_map, removed_files + [str(f) for f in changed_files], dedup)
+    if removed_nodes:
+        print(f"🧽 Đã xóa {removed_nodes} node cũ khỏi index.")
+    reindex = [Path(key) for key in sorted(reindex) if key in new_cache]
+    if reindex:
+        print(f"🔗 Index lại {len(reindex)} file có chunk trùng với node vừa bị xóa.")
+        changed_files += reindex
+
+    # Tách chunk từng file, gom qua nhiều file rồi embed + chèn theo lô lớn
+    pending, pending_count = [], 0
+
+    def flush():
+        nonlocal pending, pending_count
+        try:
+            flush_nodes(index, bm25, embed_model, cache, pending, node_map, dedup)
+        except Exception as e:
+            print(f"❌ Lỗi khi embed lô {len(pending)} file: {e}")
+            # Không ghi hash để lần sau thử lại các file này
+            for file_key, _ in pending:
+                new_cache.pop(file_key, None)
+        pending, pending_count = [], 0
+
+    for file_path in tqdm(changed_files, desc="🔍 Indexing file", ncols=100):
+        try:
+            nodes = build_nodes(file_path, parser)
+        except Exception as e:
+            print(f"❌ Lỗi khi xử lý {file_path.name}: {e}")
+            new_cache.pop(str(file_path), None)
+            continue
+        pending.append((str(file_path), nodes))
+        pending_count += len(nodes)
+        if pending_count >= INGEST_BATCH_SIZE:
+            flush()
+    if pending:
+        flush()
 
-    except Exception as e:
-        print(f"❌ Lỗi khi xử lý {file_path.name}: {e}")
+    print(f"🧠 Embedding cache: {cache.hits} hit / {cache.misses} miss")
+    if dedup is not None:
+        print(f"🧬 Gộp {dedup.collapsed} chunk gần trùng (MinHash, Jaccard >= {DEDUP_THRESHOLD})")
+    cache.close()
 
-# Lưu index và cache
-index.storage_context.persist(STORAGE_DIR)
-with open(CACHE_PATH, "w", encoding="utf-8") as f:
-    json.dump(new_cache, f, indent=2, ensure_ascii=False)
+    persist_all(index, bm25, new_cache, node_map, dedup, changed=rebuilt or new_cache != old_cache)
+    print("✅ Hoàn tất indexing.")
 
-print("✅ Hoàn tất indexing.")
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,21 @@
 import os
+import json
 import logging
 import re
 from pathlib import Path
 from tqdm import tqdm
-from multiprocessing import Pool, Manager
+from multiprocessing import Pool
 from collections import defaultdict
-from functools import partial
-from refine_utils import extract_text_with_metadata, save_documents, get_file_hash
+from refine_utils import (iter_documents, save_documents, get_file_hash, count_pdf_pages,
+                          extract_text_from_pdf, EXTRACTOR_VERSION)
 
 RAW_DIR = Path("./data/rawdata")
 REFINE_DIR = Path("./data/refine_data")
 LOG_DIR = Path("./logs")
+MANIFEST_PATH = REFINE_DIR / "refine_manifest.json"
 VALID_EXTS = {".pdf", ".docx", ".txt"}
+PDF_SPLIT_MIN_BYTES = 5 * 1024 * 1024  # PDF nhỏ hơn ngưỡng này xử lý nguyên file trong một worker
+PDF_PAGES_PER_TASK = 25                # số trang mỗi task khi tách PDF lớn
 
 REFINE_DIR.mkdir(parents=True, exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
@@ -23,34 +27,97 @@ def get_file_category(rel_path):
     category = rel_path.parts[0].lower()
     return "manual" if "manual" in category else "procedure"
 
-def process_file(file, rel_path, processed_hashes, dup_files, success_files, failed_files):
+# ===== Manifest =====
+# {
+#   "files":    { rel_path: {"size", "mtime_ns", "hash"} },                  → bỏ qua hash khi size/mtime không đổi
+#   "contents": { hash: {"source": rel_path, "outputs": [...], "extractor_version"} }  → content-addressed
+# }
+
+def load_manifest():
+    if not MANIFEST_PATH.exists():
+        return {"files": {}, "contents": {}}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.setdefault("files", {})
+    manifest.setdefault("contents", {})
+    return manifest
+
+def save_manifest(manifest):
+    # Ghi file tạm rồi đổi tên → bị ngắt giữa chừng cũng không làm hỏng manifest cũ
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_PATH)
+
+def output_paths(rel_path):
+    out_dir = REFINE_DIR / rel_path.parent
+    return [str(out_dir / f"{rel_path.stem}.txt"), str(out_dir / f"{rel_path.stem}.jsonl")]
+
+def is_content_current(entry, source):
+    return (
+        entry is not None
+        and entry.get("source") == source
+        and entry.get("extractor_version") == EXTRACTOR_VERSION
+        and all(os.path.exists(p) for p in entry.get("outputs", []))
+    )
+
+def prune_outputs(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            logging.info(f"🗑️ Xóa output lỗi thời: {path}")
+
+# ===== Worker =====
+
+def hash_file(args):
+    file, rel_path = args
+    try:
+        return rel_path, get_file_hash(file)
+    except OSError as e:
+        logging.error(f"❌ Không đọc được file: {file} → {repr(e)}")
+        return rel_path, None
+
+def save_file(file, rel_path, text_stream=None):
+    doc_type = get_file_category(rel_path)
+    out_dir = REFINE_DIR / rel_path.parent
+    basename = file.stem
+    # Generator → save_documents ghi dần từng batch node, không giữ cả tài liệu trong RAM
+    if not save_documents(iter_documents(file, doc_type, text_stream), out_dir, basename):
+        logging.warning(f"⚠️ Không trích xuất được nội dung từ file: {file}")
+        return False
+    return True
+
+def process_file(file, rel_path):
     if not file.exists():
         logging.error(f"❌ File không tồn tại: {file}")
-        failed_files.append(file)
-        return
+        return False
     try:
-        file_hash = get_file_hash(file)
-        if file_hash in processed_hashes:
-            logging.info(f"🔁 Bỏ qua file trùng lặp nội dung: {file}")
-            dup_files.append(file)
-            return
-
-        processed_hashes[file_hash] = True
-        doc_type = get_file_category(rel_path)
-        out_dir = REFINE_DIR / rel_path.parent
-        basename = file.stem
-        docs = extract_text_with_metadata(file, doc_type)
-
-        if not docs:
-            logging.warning(f"⚠️ Không trích xuất được nội dung từ file: {file}")
-            failed_files.append(file)
-            return
-
-        save_documents(docs, out_dir, basename)
-        success_files.append(file)
+        return save_file(file, rel_path)
     except Exception as e:
         logging.error(f"❌ Lỗi xử lý file: {file} → {repr(e)}")
-        failed_files.append(file)
+        return False
+
+def count_pages(args):
+    file, rel_path = args
+    try:
+        return rel_path, count_pdf_pages(file)
+    except Exception as e:
+        logging.error(f"❌ Không đọc được số trang: {file} → {repr(e)}")
+        return rel_path, None
+
+def extract_pages(file, start, end):
+    try:
+        return "".join(extract_text_from_pdf(file, start=start, end=end))
+    except Exception as e:
+        logging.error(f"❌ Lỗi đọc trang {start}-{end} của file: {file} → {repr(e)}")
+        return None
+
+def run_task(task):
+    # task: (cost, file, rel_path, start, end); start=None → xử lý cả file trong worker
+    _, file, rel_path, start, end = task
+    if start is None:
+        return rel_path, None, process_file(file, rel_path)
+    return rel_path, start, extract_pages(file, start, end)
 
 def get_all_valid_files():
     all_entries = list(RAW_DIR.rglob("*"))
@@ -67,40 +134,178 @@ def get_all_valid_files():
 
     return valid_files
 
-def process_file_wrapper(args, processed_hashes, dup_files, success_files, failed_files):
-    file, rel_path = args
-    return process_file(file, rel_path, processed_hashes, dup_files, success_files, failed_files)
+def resolve_hashes(valid_files, manifest, pool):
+    """
+    Hash của từng file; file có size + mtime khớp manifest dùng lại hash cũ, không cần đọc.
+    File đọc lỗi (lỗi tạm thời) giữ nguyên mục manifest cũ để output đã refine không bị xóa;
+    file biến mất giữa lúc quét và lúc stat/hash thì coi như đã xóa.
+    """
+    hashes, files, to_hash = {}, {}, []
+    for file, rel_path in valid_files:
+        key = rel_path.as_posix()
+        cached = manifest["files"].get(key)
+        try:
+            st = file.stat()
+        except FileNotFoundError:
+            logging.warning(f"⚠️ File đã bị xóa trong lúc quét: {file}")
+            continue
+        except OSError as e:
+            logging.error(f"❌ Không stat được file: {file} → {repr(e)}")
+            if cached:
+                hashes[key], files[key] = cached["hash"], cached
+            continue
+        files[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+            hashes[key] = cached["hash"]
+            files[key]["hash"] = cached["hash"]
+        else:
+            to_hash.append((file, rel_path))
 
-if __name__ == "__main__":
+    if to_hash:
+        with tqdm(total=len(to_hash), desc="🔑 Đang hash file mới/đổi", ncols=100) as pbar:
+            for rel_path, file_hash in pool.imap_unordered(hash_file, to_hash):
+                key = rel_path.as_posix()
+                cached = manifest["files"].get(key)
+                if file_hash is not None:
+                    hashes[key] = file_hash
+                    files[key]["hash"] = file_hash
+                elif cached and (RAW_DIR / rel_path).exists():
+                    # Giữ mục cũ (kèm size/mtime cũ → lần sau hash lại) thay vì xóa output tốt
+                    hashes[key], files[key] = cached["hash"], cached
+                else:
+                    files.pop(key, None)
+                pbar.update(1)
+
+    return hashes, files, len(valid_files) - len(to_hash)
+
+def pick_canonicals(hashes, manifest):
+    """
+    Chọn đúng một file đại diện cho mỗi nội dung. Quyết định trong process cha sau khi đã có
+    đủ hash nên không còn race check-then-set giữa các worker. Giữ file đại diện cũ nếu còn.
+    """
+    groups = defaultdict(list)
+    for key, file_hash in hashes.items():
+        groups[file_hash].append(key)
+    canonicals = {}
+    for file_hash, keys in groups.items():
+        previous = manifest["contents"].get(file_hash, {}).get("source")
+        canonicals[file_hash] = previous if previous in keys else min(keys)
+    return canonicals, groups
+
+def file_size(file):
+    # File vừa biến mất → chi phí 0, việc refine của nó sẽ báo lỗi như file đọc không được
+    try:
+        return file.stat().st_size
+    except OSError:
+        return 0
+
+def plan_tasks(sources, paths_by_key, pool):
+    """
+    Chia việc: PDF lớn được tách thành các khoảng PDF_PAGES_PER_TASK trang để nhiều worker đọc
+    song song; sắp xếp việc lớn trước (LPT) để file to nhất không còn chạy một mình ở cuối.
+    Chi phí ước lượng theo dung lượng file (chia đều cho các khoảng trang).
+    """
+    sizes = {key: file_size(paths_by_key[key][0]) for key in sources}
+    big_pdfs = [paths_by_key[key] for key in sources
+                if key.lower().endswith(".pdf") and sizes[key] >= PDF_SPLIT_MIN_BYTES]
+    page_counts = {rel_path.as_posix(): n for rel_path, n in pool.imap_unordered(count_pages, big_pdfs)}
+
+    tasks, parts_expected = [], {}
+    for key in sources:
+        file, rel_path = paths_by_key[key]
+        n_pages = page_counts.get(key)
+        if not n_pages or n_pages <= PDF_PAGES_PER_TASK:
+            tasks.append((sizes[key], file, rel_path, None, None))
+            continue
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, n_pages)) for start in range(0, n_pages, PDF_PAGES_PER_TASK)]
+        parts_expected[key] = len(ranges)
+        tasks.extend((sizes[key] * (end - start) / n_pages, file, rel_path, start, end) for start, end in ranges)
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return tasks, parts_expected
+
+def run_tasks(tasks, parts_expected, pool):
+    """Chạy các task, ghép các khoảng trang theo đúng thứ tự rồi ghi; trả (rel_path, ok) theo từng file."""
+    parts = defaultdict(dict)
+    # chunksize=1 để giữ đúng thứ tự LPT khi phân phát cho worker
+    for rel_path, start, result in pool.imap_unordered(run_task, tasks, chunksize=1):
+        if start is None:
+            yield rel_path, result
+            continue
+        key = rel_path.as_posix()
+        parts[key][start] = result
+        if len(parts[key]) < parts_expected[key]:
+            continue
+        pages = parts.pop(key)
+        if any(text is None for text in pages.values()):
+            yield rel_path, False
+            continue
+        file = RAW_DIR / rel_path
+        try:
+            yield rel_path, save_file(file, rel_path, (pages[start] for start in sorted(pages)))
+        except Exception as e:
+            logging.error(f"❌ Lỗi ghi file: {file} → {repr(e)}")
+            yield rel_path, False
+
+def main():
     valid_files = get_all_valid_files()
+    paths_by_key = {rel_path.as_posix(): (file, rel_path) for file, rel_path in valid_files}
+    manifest = load_manifest()
+
+    with Pool(processes=min(os.cpu_count() * 2, 16)) as pool:
+        hashes, files, unchanged_stat = resolve_hashes(valid_files, manifest, pool)
+        canonicals, groups = pick_canonicals(hashes, manifest)
+
+        # Nội dung mất (file bị xóa/sửa) hoặc đổi file đại diện → output cũ thành rác
+        for file_hash, entry in manifest["contents"].items():
+            if canonicals.get(file_hash) != entry.get("source"):
+                prune_outputs(entry.get("outputs", []))
+
+        contents = {}
+        jobs = []
+        for file_hash, source in canonicals.items():
+            entry = manifest["contents"].get(file_hash)
+            if is_content_current(entry, source):
+                contents[file_hash] = entry
+            else:
+                jobs.append((file_hash, source))
+
+        dup_files = [key for file_hash, keys in groups.items() for key in keys if key != canonicals[file_hash]]
+        for key in dup_files:
+            logging.info(f"🔁 Bỏ qua file trùng lặp nội dung: {RAW_DIR / key}")
 
-    with Manager() as manager:
-        processed_hashes = manager.dict()
-        dup_files = manager.list()
-        success_files = manager.list()
-        failed_files = manager.list()
-
-        with Pool(processes=min(os.cpu_count() * 2, 16)) as pool:
-            with tqdm(total=len(valid_files), desc="🧹 Đang refine", ncols=100) as pbar:
-                func = partial(process_file_wrapper,
-                               processed_hashes=processed_hashes,
-                               dup_files=dup_files,
-                               success_files=success_files,
-                               failed_files=failed_files)
-                for _ in pool.imap_unordered(func, valid_files):
-                    pbar.update(1)
-
-        logging.info(f"🔁 Số file bị trùng nội dung : {len(dup_files)}")
-        logging.info(f"✅ Số file xử lý thành công  : {len(success_files)}")
-        logging.warning(f"❌ Số file không xử lý được  : {len(failed_files)}")
-
-        # ✅ Sao chép danh sách sau khi Manager đóng
-        success_files_list = list(success_files)
+        success_files, failed_files = [], []
+        hash_by_source = {source: file_hash for file_hash, source in jobs}
+        tasks, parts_expected = plan_tasks([source for _, source in jobs], paths_by_key, pool)
+        if parts_expected:
+            logging.info(f"📑 Tách {len(parts_expected)} PDF lớn thành "
+                         f"{sum(parts_expected.values())} khoảng trang để xử lý song song")
+        with tqdm(total=len(jobs), desc="🧹 Đang refine", ncols=100) as pbar:
+            for rel_path, ok in run_tasks(tasks, parts_expected, pool):
+                key = rel_path.as_posix()
+                if ok:
+                    success_files.append(rel_path)
+                    contents[hash_by_source[key]] = {
+                        "source": key,
+                        "outputs": output_paths(rel_path),
+                        "extractor_version": EXTRACTOR_VERSION,
+                    }
+                else:
+                    # Không ghi vào contents → lần chạy sau sẽ thử lại
+                    failed_files.append(rel_path)
+                    prune_outputs(output_paths(rel_path))
+                pbar.update(1)
+
+    save_manifest({"files": files, "contents": contents})
+
+    logging.info(f"⏭️ Số file không đổi (size/mtime): {unchanged_stat}")
+    logging.info(f"♻️ Số nội dung đã refine từ trước: {len(canonicals) - len(jobs)}")
+    logging.info(f"🔁 Số file bị trùng nội dung : {len(dup_files)}")
+    logging.info(f"✅ Số file xử lý thành công  : {len(success_files)}")
+    logging.warning(f"❌ Số file không xử lý được  : {len(failed_files)}")
 
     # ✅ Thống kê thư mục đầu ra
     output_folders = defaultdict(int)
-    for f in success_files_list:
-        rel = f.relative_to(RAW_DIR)
+    for rel in success_files:
         subfolder = rel.parent
         output_folders[subfolder] += 1
 
@@ -110,3 +315,6 @@ if __name__ == "__main__":
             line = f"   - 📄 {count} file → 📂 {REFINE_DIR / folder}"
             print(line)
             logf.write(line + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 import os
 import re
+import json
 from pathlib import Path
-from tqdm import tqdm
 from underthesea import sent_tokenize
+from refine_utils import get_file_hash
+from utils.progress_bar import run_parallel_pipeline, run_sequential_pipeline
 
 REFINE_INPUT_DIR = Path("./data/refine_data")
 REFINE_OUTPUT_DIR = Path("./data/refine_cleaner")
+MANIFEST_PATH = REFINE_OUTPUT_DIR / "clean_manifest.json"
 VALID_EXTS = {".txt"}
+CLEANER_VERSION = 1  # tăng khi đổi logic làm sạch/tách câu → làm sạch lại toàn bộ
+CLEAN_WORKERS = int(os.getenv("CLEAN_WORKERS", str(os.cpu_count() or 1)))  # 1 → chạy tuần tự
+LONG_TEXT_CHARS = 200000  # text dài hơn ngưỡng này được cắt thành nhiều đoạn để tách câu song song
+# Chọn file dài theo dung lượng (không phải đọc file): tiếng Việt UTF-8 trung bình ~1.5 byte/ký tự
+LONG_FILE_BYTES = LONG_TEXT_CHARS * 3 // 2
+
+# Biên dịch một lần thay vì mỗi dòng
+PAGE_NUMBER_RE = re.compile(r"(trang|page)?\s*\d+(/\d+)?", flags=re.IGNORECASE)
+SENTENCE_END_RE = re.compile(r"[.!?…][\"'”)\]]*\s")
 
 REFINE_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -20,7 +32,7 @@ def clean_lines(lines):
             continue
 
         # Bỏ dòng chỉ chứa số trang hoặc "Trang 1/4", "Page 2"
-        if re.fullmatch(r"(trang|page)?\s*\d+(/\d+)?", line.strip(), flags=re.IGNORECASE):
+        if PAGE_NUMBER_RE.fullmatch(line):
             continue
 
         # Bỏ dòng ngắn <= 3 từ trôi nổi không đủ ngữ nghĩa
@@ -50,30 +62,150 @@ def merge_short_lines(lines, min_len=40):
 def split_sentences_smart(text):
     return sent_tokenize(text)
 
-def clean_file(in_path: Path, out_path: Path):
-    lines = in_path.read_text(encoding="utf-8", errors="ignore").splitlines()
-    lines = clean_lines(lines)
+def split_at_safe_boundaries(text, max_chars=LONG_TEXT_CHARS):
+    """
+    Cắt text dài thành các đoạn <= max_chars tại ranh giới câu (dấu kết câu + khoảng trắng),
+    nếu không có thì tại khoảng trắng, để tách câu từng đoạn độc lập cho cùng kết quả.
+    """
+    pieces = []
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        # Tìm ranh giới câu cuối cùng trong nửa sau của cửa sổ
+        cut = -1
+        for match in SENTENCE_END_RE.finditer(text, start + max_chars // 2, end):
+            cut = match.end()
+        if cut == -1:
+            cut = text.rfind(" ", start + 1, end) + 1 or end
+        pieces.append(text[start:cut])
+        start = cut
+    pieces.append(text[start:])
+    return pieces
+
+def clean_text(text):
+    lines = clean_lines(text.splitlines())
     lines = merge_short_lines(lines)
-    text = " ".join(lines)
-    sentences = split_sentences_smart(text)
+    return " ".join(lines)
 
+def prepare_text(in_path: Path):
+    return clean_text(in_path.read_text(encoding="utf-8", errors="ignore"))
+
+def write_sentences(sentences, out_path: Path):
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         for sent in sentences:
             sent = sent.strip()
             if sent:
                 f.write(sent + "\n\n")
+    os.replace(tmp, out_path)
+
+def clean_file(in_path: Path, out_path: Path):
+    write_sentences(split_sentences_smart(prepare_text(in_path)), out_path)
+
+def clean_file_task(rel_path):
+    # Worker: trả lại rel_path nếu thành công, None nếu lỗi (không làm hỏng cả pool)
+    try:
+        clean_file(REFINE_INPUT_DIR / rel_path, REFINE_OUTPUT_DIR / rel_path)
+        return rel_path
+    except Exception as e:
+        print(f"❌ Lỗi làm sạch file {rel_path}: {repr(e)}")
+        return None
+
+def tokenize_piece(item):
+    # Worker: trả None thay cho danh sách câu nếu lỗi → chỉ file chứa đoạn đó bị bỏ, pool vẫn chạy tiếp
+    rel_path, index, text = item
+    try:
+        return rel_path, index, split_sentences_smart(text)
+    except Exception as e:
+        print(f"❌ Lỗi tách câu đoạn {index} của {rel_path}: {repr(e)}")
+        return rel_path, index, None
 
 def get_all_txt_files(base_dir):
     return [f for f in base_dir.rglob("*") if f.suffix.lower() in VALID_EXTS and f.is_file()]
 
-if __name__ == "__main__":
-    input_files = get_all_txt_files(REFINE_INPUT_DIR)
+def load_manifest():
+    if not MANIFEST_PATH.exists():
+        return {}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_PATH)
+
+def run_pipeline(items, func, desc):
+    if CLEAN_WORKERS > 1 and len(items) > 1:
+        return run_parallel_pipeline(items, func, max_processes=min(CLEAN_WORKERS, len(items)), desc=desc)
+    return run_sequential_pipeline(items, func, desc=desc)
+
+def clean_long_files(rel_paths):
+    """Text rất dài: làm sạch dòng ở process cha, cắt tại ranh giới câu rồi tách câu song song từng đoạn."""
+    # Lỗi ở bước nào cũng chỉ loại file đó: không ghi vào manifest, lần sau thử lại
+    pieces, failed = [], set()
+    for rel_path in rel_paths:
+        try:
+            text = prepare_text(REFINE_INPUT_DIR / rel_path)
+        except Exception as e:
+            print(f"❌ Lỗi làm sạch file {rel_path}: {repr(e)}")
+            failed.add(rel_path)
+            continue
+        pieces.extend((rel_path, i, piece) for i, piece in enumerate(split_at_safe_boundaries(text)))
 
-    print(f"🧹 Đang làm sạch {len(input_files)} file refine với underthesea...")
-    for in_file in tqdm(input_files, desc="🧠 Tách câu tiếng Việt", ncols=100):
-        rel_path = in_file.relative_to(REFINE_INPUT_DIR)
-        out_file = REFINE_OUTPUT_DIR / rel_path
-        clean_file(in_file, out_file)
+    sentences = {rel_path: {} for rel_path in rel_paths if rel_path not in failed}
+    for rel_path, index, sents in run_pipeline(pieces, tokenize_piece, "🧠 Tách câu (file dài)"):
+        if sents is None:
+            failed.add(rel_path)
+        else:
+            sentences[rel_path][index] = sents
+
+    for rel_path, parts in sentences.items():
+        if rel_path in failed:
+            continue
+        try:
+            write_sentences((s for i in sorted(parts) for s in parts[i]), REFINE_OUTPUT_DIR / rel_path)
+        except Exception as e:
+            print(f"❌ Lỗi ghi file {rel_path}: {repr(e)}")
+            failed.add(rel_path)
+    return [p for p in rel_paths if p not in failed]
+
+def main():
+    input_files = get_all_txt_files(REFINE_INPUT_DIR)
+    manifest = load_manifest()
+
+    current, todo = {}, []
+    for in_file in input_files:
+        rel_path = in_file.relative_to(REFINE_INPUT_DIR).as_posix()
+        entry = {"hash": get_file_hash(in_file), "version": CLEANER_VERSION}
+        current[rel_path] = entry
+        if manifest.get(rel_path) != entry or not (REFINE_OUTPUT_DIR / rel_path).exists():
+            todo.append(rel_path)
+
+    # File refine đã bị xóa → xóa luôn bản đã làm sạch
+    for rel_path in manifest:
+        if rel_path not in current and (REFINE_OUTPUT_DIR / rel_path).exists():
+            (REFINE_OUTPUT_DIR / rel_path).unlink()
+
+    long_files = [p for p in todo if (REFINE_INPUT_DIR / p).stat().st_size > LONG_FILE_BYTES]
+    long_set = set(long_files)
+    short_files = [p for p in todo if p not in long_set]
+
+    print(f"🧹 Đang làm sạch {len(todo)}/{len(input_files)} file refine với underthesea "
+          f"({len(input_files) - len(todo)} file không đổi, {len(long_files)} file dài)...")
+    done = run_pipeline(short_files, clean_file_task, "🧠 Tách câu tiếng Việt")
+    if long_files:
+        done += clean_long_files(long_files)
+
+    # Chỉ ghi nhận file làm sạch thành công → file lỗi sẽ được thử lại lần sau
+    succeeded = set(p for p in done if p is not None)
+    save_manifest({p: entry for p, entry in current.items() if p in succeeded or p not in todo})
+    failed = [p for p in todo if p not in succeeded]
+    if failed:
+        print(f"⚠️ {len(failed)} file làm sạch lỗi, sẽ thử lại lần sau: {', '.join(failed)}")
 
     print("✅ Hoàn tất làm sạch văn bản. Kết quả lưu vào:", REFINE_OUTPUT_DIR)
+
+if __name__ == "__main__":
+    main()
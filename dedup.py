@@ -0,0 +1,165 @@
+# dedup.py
+
+import os
+import re
+import json
+import zlib
+from pathlib import Path
+import numpy as np
+
+SIGNATURES_FNAME = "minhash_signatures.npy"
+DEDUP_FNAME = "chunk_sources.json"  # node_id chuẩn + danh sách file chứa bản gần trùng của nó
+_WORD_RE = re.compile(r"\w+", flags=re.UNICODE)
+
+class ChunkDeduplicator:
+    """
+    MinHash + LSH banding để gộp các chunk gần trùng (boilerplate lặp lại giữa các quy trình qtdc*).
+    Chỉ node chuẩn (canonical) được embed/chèn vào index; các bản trùng chỉ để lại tham chiếu nguồn.
+
+    Chữ ký gồm `num_perm` giá trị min-hash trên shingle `shingle_size` từ; chia thành `bands` band,
+    hai chunk rơi vào cùng bucket ở ít nhất một band là ứng viên, sau đó kiểm tra lại bằng
+    Jaccard ước lượng (tỉ lệ giá trị min-hash trùng nhau) >= `threshold`.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=16, shingle_size=5, seed=1):
+        assert num_perm % bands == 0, "num_perm phải chia hết cho bands"
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        # Họ hàm băm multiply-shift: h(x) = ((a·x + b) mod 2^64) >> 32, a lẻ
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 1 << 64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 64, size=num_perm, dtype=np.uint64)
+        self.signatures = {}  # node_id chuẩn → chữ ký (uint32[num_perm])
+        self.buckets = {}     # (band, bytes của band) → [node_id]
+        self.sources = {}     # node_id chuẩn → [file_key của các chunk trùng đã gộp vào]
+        self.collapsed = 0    # số chunk đã gộp trong lần chạy này
+
+    # ===== Chữ ký =====
+
+    def shingles(self, text):
+        words = _WORD_RE.findall(text.lower())
+        if len(words) < self.shingle_size:
+            grams = [" ".join(words)] if words else []
+        else:
+            grams = (" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1))
+        return np.fromiter({zlib.crc32(g.encode("utf-8")) for g in grams}, dtype=np.uint64)
+
+    def signature(self, text):
+        shingles = self.shingles(text)
+        if not len(shingles):
+            return None
+        hashed = (shingles[:, None] * self.a[None, :] + self.b[None, :]) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    # ===== Truy vấn / cập nhật =====
+
+    def find(self, signature):
+        """Node chuẩn gần trùng nhất với `signature` (Jaccard ước lượng >= threshold) hoặc None."""
+        if signature is None:
+            return None
+        candidates = {node_id for key in self._band_keys(signature) for node_id in self.buckets.get(key, ())}
+        best, best_score = None, self.threshold
+        for node_id in candidates:
+            score = float(np.mean(self.signatures[node_id] == signature))
+            if score >= best_score:
+                best, best_score = node_id, score
+        return best
+
+    def add(self, node_id, signature):
+        if signature is None:
+            return
+        self.signatures[node_id] = signature
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(node_id)
+
+    def add_source(self, node_id, file_key):
+        self.sources.setdefault(node_id, []).append(file_key)
+
+    def remove_nodes(self, node_ids):
+        """Bỏ các node chuẩn khỏi LSH; trả về các file có chunk đã gộp vào chúng (cần index lại)."""
+        orphaned = set()
+        for node_id in node_ids:
+            signature = self.signatures.pop(node_id, None)
+            if signature is not None:
+                for key in self._band_keys(signature):
+                    bucket = self.buckets.get(key, [])
+                    if node_id in bucket:
+                        bucket.remove(node_id)
+                    if not bucket:
+                        self.buckets.pop(key, None)
+            orphaned.update(self.sources.pop(node_id, []))
+        return orphaned
+
+    def remove_file_refs(self, file_key):
+        for node_id in list(self.sources):
+            refs = [ref for ref in self.sources[node_id] if ref != file_key]
+            if refs:
+                self.sources[node_id] = refs
+            else:
+                del self.sources[node_id]
+
+    def dedup_nodes(self, file_key, nodes):
+        """Lọc `nodes` của một file: trả về các node chuẩn cần chèn, gộp bản gần trùng vào node đã có."""
+        kept = []
+        for node in nodes:
+            signature = self.signature(node.get_content())
+            canonical = self.find(signature)
+            if canonical is not None:
+                self.add_source(canonical, file_key)
+                self.collapsed += 1
+                continue
+            self.add(node.node_id, signature)
+            kept.append(node)
+        return kept
+
+    # ===== Lưu / nạp =====
+
+    @staticmethod
+    def exists(persist_dir):
+        persist_dir = Path(persist_dir)
+        return (persist_dir / SIGNATURES_FNAME).exists() and (persist_dir / DEDUP_FNAME).exists()
+
+    def save(self, persist_dir):
+        persist_dir = Path(persist_dir)
+        ids = list(self.signatures)
+        matrix = np.stack([self.signatures[i] for i in ids]) if ids else np.zeros((0, self.num_perm), np.uint32)
+        # np.save tự thêm đuôi .npy → đặt tên tạm có sẵn .npy
+        tmp_npy = persist_dir / f"tmp_{SIGNATURES_FNAME}"
+        np.save(tmp_npy, matrix)
+        tmp_json = persist_dir / f"{DEDUP_FNAME}.tmp"
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump({
+                "params": {"threshold": self.threshold, "num_perm": self.num_perm, "bands": self.bands,
+                           "shingle_size": self.shingle_size, "seed": self.seed},
+                "ids": ids,
+                "sources": self.sources,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_npy, persist_dir / SIGNATURES_FNAME)
+        os.replace(tmp_json, persist_dir / DEDUP_FNAME)
+
+    @classmethod
+    def load(cls, persist_dir):
+        persist_dir = Path(persist_dir)
+        with open(persist_dir / DEDUP_FNAME, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        dedup = cls(**data["params"])
+        matrix = np.load(persist_dir / SIGNATURES_FNAME)
+        for node_id, signature in zip(data["ids"], matrix):
+            dedup.add(node_id, signature)
+        dedup.sources = data["sources"]
+        return dedup
+
+def load_chunk_sources(persist_dir):
+    # Chỉ đọc phần tham chiếu nguồn (chatbot không cần chữ ký MinHash)
+    path = Path(persist_dir) / DEDUP_FNAME
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["sources"]
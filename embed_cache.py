@@ -0,0 +1,74 @@
+# embed_cache.py
+
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Cache embedding trên đĩa, khóa theo hash(tên model + nội dung chunk).
+    Chunk trùng nội dung (boilerplate giữa các quy trình) chỉ cần embed một lần.
+    """
+
+    def __init__(self, path: Path, model_name: str):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        # SQLite giới hạn số tham số trong một câu lệnh → truy vấn theo lô
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items.items()],
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+def embed_texts(embed_model, cache: EmbeddingCache, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+    """
+    Trả về embedding cho `texts`, chỉ gọi model cho các chunk chưa có trong cache.
+    Các chunk thiếu được gom thành lô cố định `batch_size` trước khi embed.
+    """
+    keys = [cache.key(t) for t in texts]
+    found = cache.get_many(list(set(keys)))
+
+    # Loại trùng trong cùng lô để không embed hai lần cùng một chunk
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    cache.hits += len(texts) - len(missing)
+    cache.misses += len(missing)
+
+    missing_keys = list(missing)
+    for i in range(0, len(missing_keys), batch_size):
+        batch_keys = missing_keys[i:i + batch_size]
+        vectors = embed_model.get_text_embedding_batch([missing[k] for k in batch_keys])
+        new_items = dict(zip(batch_keys, vectors))
+        cache.put_many(new_items)
+        found.update(new_items)
+
+    return [found[key] for key in keys]
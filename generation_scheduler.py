@@ -0,0 +1,286 @@
+# generation_scheduler.py
+
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# torch/transformers được import bên trong hàm, giống load_model.py
+
+class GenerationRequest:
+    """Một prompt chờ sinh: kết quả trả qua `future`, các đoạn text mới qua `deltas` nếu stream."""
+
+    def __init__(self, prompt, max_new_tokens, stream=False):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.future = Future()
+        self.deltas = queue.Queue() if stream else None  # None đánh dấu kết thúc
+        self.text = ""
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        # Còn trong hàng đợi → bị bỏ trước khi vào batch; đang sinh → dừng dòng của nó ở bước kế tiếp
+        self._cancelled.set()
+
+    def _push(self, text):
+        # Giữ lại ký tự UTF-8 chưa giải mã xong (token BPE cắt giữa một ký tự tiếng Việt)
+        if text.endswith("�") or len(text) <= len(self.text):
+            return
+        if self.deltas is not None:
+            self.deltas.put(text[len(self.text):])
+        self.text = text
+
+    def _finish(self, text=None, error=None):
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            if text is not None:
+                self._push(text)
+            self.future.set_result(self.text)
+        if self.deltas is not None:
+            self.deltas.put(None)
+
+class _BatchStopper:
+    """
+    StoppingCriteria theo từng dòng của batch: dừng dòng đã đủ max_new_tokens riêng, đã sinh EOS
+    hoặc bị hủy; đồng thời đẩy text mới của các request stream ra ngay sau mỗi bước.
+    (Chỉ cần là callable, StoppingCriteriaList không bắt buộc kế thừa StoppingCriteria.)
+    """
+
+    def __init__(self, tokenizer, requests, prompt_len, eos_ids):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.prompt_len = prompt_len
+        self.eos_ids = eos_ids
+        self.finished = [False] * len(requests)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        generated = input_ids[:, self.prompt_len:]
+        for i, request in enumerate(self.requests):
+            if self.finished[i]:
+                continue
+            ids = generated[i].tolist()
+            if request.deltas is not None:
+                request._push(self.tokenizer.decode(ids, skip_special_tokens=True))
+            if request.cancelled or len(ids) >= request.max_new_tokens or (ids and ids[-1] in self.eos_ids):
+                self.finished[i] = True
+        return torch.tensor(self.finished, dtype=torch.bool, device=input_ids.device)
+
+class GenerationScheduler:
+    """
+    Gom các prompt đến gần nhau (trong `window_ms`, tối đa `max_batch_size`) thành một lần
+    model.generate với left padding, rồi trả kết quả về cho từng caller qua Future.
+    Một thread nền chạy batch; batch sau bắt đầu khi batch trước xong, các prompt đến trong lúc đó
+    tự gom thành batch kế tiếp. Mỗi request có max_new_tokens riêng và có thể hủy giữa chừng.
+
+    Prompt có thể là str hoặc prompt_builder.Prompt. Khi mọi Prompt trong batch dùng chung prefix của
+    `prefix_cache`, prefix không được prefill lại: padding đặt giữa prefix và phần riêng của từng dòng
+    (attention_mask = 0), position_ids suy từ attention_mask nên vẫn liền mạch với KV đã cache.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, window_ms=20, max_new_tokens=256, generate_kwargs=None,
+                 prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_cache = prefix_cache
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Decoder-only phải pad bên trái để token cuối của mọi prompt thẳng hàng khi sinh
+        tokenizer.padding_side = "left"
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.generate_kwargs = dict(generate_kwargs or {})
+        self.generate_kwargs.setdefault("pad_token_id", tokenizer.pad_token_id)
+        eos = getattr(model.generation_config, "eos_token_id", None) or tokenizer.eos_token_id
+        self.eos_ids = set(eos if isinstance(eos, list) else [eos])
+        self.batches = 0
+        self.requests = 0
+        self._pending = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+        self._thread.start()
+
+    # ===== API cho caller =====
+
+    def submit(self, prompt, max_new_tokens=None, stream=False):
+        if self._closed:
+            raise RuntimeError("GenerationScheduler đã đóng")
+        request = GenerationRequest(prompt, min(max_new_tokens or self.max_new_tokens, self.max_new_tokens), stream)
+        self._pending.put(request)
+        return request
+
+    def generate(self, prompt, max_new_tokens=None, timeout=None):
+        request = self.submit(prompt, max_new_tokens)
+        try:
+            return request.future.result(timeout)
+        except BaseException:
+            request.cancel()
+            raise
+
+    def stream(self, prompt, max_new_tokens=None):
+        request = self.submit(prompt, max_new_tokens, stream=True)
+        try:
+            while True:
+                delta = request.deltas.get()
+                if delta is None:
+                    break
+                yield delta
+            request.future.result()  # đưa lỗi của batch (nếu có) ra cho caller
+        finally:
+            # Caller bỏ dở generator (client ngắt kết nối) → hủy để batch không sinh tiếp cho dòng này
+            request.cancel()
+
+    def stats(self):
+        return {"batches": self.batches, "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0}
+
+    def close(self):
+        self._closed = True
+        self._pending.put(None)
+        self._thread.join()
+
+    # ===== Thread nền =====
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._pending.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._pending.put(None)  # để vòng lặp chính thấy tín hiệu đóng sau batch này
+                break
+            batch.append(request)
+        return batch
+
+    def _loop(self):
+        while True:
+            first = self._pending.get()
+            if first is None:
+                break
+            batch = []
+            for request in self._collect(first):
+                if request.cancelled:
+                    request._finish("")
+                else:
+                    batch.append(request)
+            if batch:
+                self._run_batch(batch)
+
+    def _encode(self, prompts):
+        import torch
+
+        pad = self.tokenizer.pad_token_id
+        cache = self.prefix_cache
+        extra = {}
+        if cache is not None and all(getattr(p, "prefix_ids", None) == cache.prefix_ids for p in prompts):
+            width = max(len(p.suffix_ids) for p in prompts)
+            prefix_mask = [1] * len(cache.prefix_ids)
+            rows = [cache.prefix_ids + [pad] * (width - len(p.suffix_ids)) + p.suffix_ids for p in prompts]
+            masks = [prefix_mask + [0] * (width - len(p.suffix_ids)) + [1] * len(p.suffix_ids) for p in prompts]
+            extra["past_key_values"] = cache.for_batch(len(prompts))
+        else:
+            ids = [p.prefix_ids + p.suffix_ids if hasattr(p, "suffix_ids") else self.tokenizer.encode(p) for p in prompts]
+            width = max(len(x) for x in ids)
+            rows = [[pad] * (width - len(x)) + x for x in ids]
+            masks = [[0] * (width - len(x)) + [1] * len(x) for x in ids]
+        device = self.model.device
+        return {"input_ids": torch.tensor(rows, device=device),
+                "attention_mask": torch.tensor(masks, device=device), **extra}
+
+    def _run_batch(self, batch):
+        import torch
+        from transformers import StoppingCriteriaList
+
+        try:
+            inputs = self._encode([r.prompt for r in batch])
+            prompt_len = inputs["input_ids"].shape[1]
+            stopper = _BatchStopper(self.tokenizer, batch, prompt_len, self.eos_ids)
+            with torch.no_grad():
+                output = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max(r.max_new_tokens for r in batch),
+                    stopping_criteria=StoppingCriteriaList([stopper]),
+                    **self.generate_kwargs,
+                )
+            for i, request in enumerate(batch):
+                ids = output[i, prompt_len:prompt_len + request.max_new_tokens]
+                request._finish(self.tokenizer.decode(ids, skip_special_tokens=True))
+        except Exception as e:
+            for request in batch:
+                request._finish(error=e)
+        self.batches += 1
+        self.requests += len(batch)
+
+def check_batching(model_name, prompts, max_new_tokens=32):
+    """
+    So sánh sinh tuần tự từng prompt với gửi đồng thời qua scheduler (greedy):
+    câu trả lời phải giống nhau và thời gian wall phải giảm.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+    kwargs = {"max_new_tokens": max_new_tokens, "generate_kwargs": {"do_sample": False}}
+    single = GenerationScheduler(model, tokenizer, max_batch_size=1, window_ms=0, **kwargs)
+    start = time.perf_counter()
+    sequential = [single.generate(p) for p in prompts]
+    sequential_seconds = time.perf_counter() - start
+    single.close()
+
+    scheduler = GenerationScheduler(model, tokenizer, max_batch_size=len(prompts), window_ms=50, **kwargs)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+        batched = list(pool.map(scheduler.generate, prompts))
+    batched_seconds = time.perf_counter() - start
+
+    # Hủy giữa chừng: stream bị bỏ sau token đầu tiên không được chặn các request khác
+    stream = scheduler.stream(prompts[0])
+    next(stream, None)
+    stream.close()
+    stats = scheduler.stats()
+    scheduler.close()
+    return {
+        "prompts": len(prompts),
+        "sequential_seconds": round(sequential_seconds, 3),
+        "batched_seconds": round(batched_seconds, 3),
+        "speedup": round(sequential_seconds / batched_seconds, 2),
+        "identical": sum(a == b for a, b in zip(sequential, batched)),
+        **stats,
+    }
+
+if __name__ == "__main__":
+    # python generation_scheduler.py [model] → kiểm tra nhanh trên CPU với model nhỏ
+    model_name = sys.argv[1] if len(sys.argv) > 1 else "sshleifer/tiny-gpt2"
+    prompts = [
+        "Quy trình triển khai thiết bị tại Datacenter gồm",
+        "How do I replace the battery on the Eaton 9130 UPS?",
+        "Cách đấu nối cáp nguồn cho rack mới",
+        "Biên bản bàn giao thiết bị cần có",
+        "The NX range cabinets must be anchored",
+        "Trưởng ca cần làm gì khi có sự cố",
+        "Firmware của PDU được cập nhật",
+        "Battery runtime depends on",
+    ]
+    report = check_batching(model_name, prompts)
+    print(f"🧪 Batched generation: {report}")
+    ok = report["identical"] == report["prompts"] and report["speedup"] > 1.0
+    print("✅ Đạt" if ok else "⚠️ Kết quả batch khác tuần tự hoặc không nhanh hơn")
+    raise SystemExit(0 if ok else 1)
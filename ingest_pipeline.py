@@ -0,0 +1,253 @@
+# ingest_pipeline.py
+
+import os
+import time
+import queue
+import argparse
+import threading
+import multiprocessing as mp
+from pathlib import Path
+from collections import defaultdict
+from tqdm import tqdm
+from llama_index.core.node_parser import SentenceSplitter
+from refine_utils import get_file_hash, open_text_stream
+from data_refine_cleaner import clean_text, split_sentences_smart
+from embed_cache import EmbeddingCache
+import data_indexing as di
+
+# Một lệnh duy nhất: file gốc → extract → clean → chunk → embed/insert, các stage nối với nhau
+# bằng multiprocessing.Queue có giới hạn nên không ghi ra data/refine_data, data/refine_cleaner
+# và chỉ tách chunk một lần (SentenceSplitter), không qua split_into_nodes.
+RAW_DIR = Path("./data/rawdata")
+VALID_EXTS = {".pdf", ".docx", ".txt"}
+MATERIALIZE_DIR = Path("./data/pipeline_debug")
+QUEUE_SIZE = 8                      # số file tối đa nằm chờ giữa hai stage → bộ nhớ có giới hạn
+EXTRACT_WORKERS = max(1, min((os.cpu_count() or 2) // 2, 8))
+CLEAN_WORKERS = max(1, min((os.cpu_count() or 2) // 2, 8))
+CHUNK_WORKERS = 1
+STAGES = ["extract", "clean", "chunk", "embed"]
+RESULT_POLL_SECONDS = 5.0           # chu kỳ kiểm tra process stage còn sống khi chờ kết quả
+
+_parser = None  # SentenceSplitter tạo một lần cho mỗi process chunk
+
+def file_key(rel_path: Path) -> str:
+    # Khóa là đường dẫn file gốc (giữ đuôi: a.pdf và a.docx cùng thư mục là hai khóa khác nhau).
+    # file_cache lưu hash file gốc dưới khóa này, tách biệt với khóa refine_cleaner/*.txt (hash text đã làm sạch)
+    # của data_indexing.py → không khóa nào bị ghi đè bằng hash khác loại. Đổi qua lại giữa hai công cụ thì
+    # khóa của công cụ kia được coi là file đã xóa và index lại (embedding cache tránh phải embed lại).
+    return str(RAW_DIR / rel_path)
+
+def materialize(materialize_dir, stage, rel_path, text):
+    if materialize_dir is None:
+        return
+    out = Path(materialize_dir) / stage / rel_path.parent / f"{rel_path.name}.txt"  # giữ đuôi gốc: a.pdf → a.pdf.txt
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(text, encoding="utf-8")
+
+# ===== Stage (chạy trong process con) =====
+
+def extract_stage(item, materialize_dir):
+    text = "".join(open_text_stream(item["path"]) or [])
+    if not text.strip():
+        raise ValueError("không trích xuất được nội dung")
+    materialize(materialize_dir, "extract", item["rel_path"], text)
+    item["text"] = text
+
+def clean_stage(item, materialize_dir):
+    sentences = split_sentences_smart(clean_text(item.pop("text")))
+    text = "".join(sent.strip() + "\n\n" for sent in sentences if sent.strip())
+    materialize(materialize_dir, "clean", item["rel_path"], text)
+    item["text"] = text
+
+def chunk_stage(item, materialize_dir):
+    global _parser
+    if _parser is None:
+        _parser = SentenceSplitter(chunk_size=di.CHUNK_SIZE, chunk_overlap=di.CHUNK_OVERLAP)
+    item["nodes"] = di.build_nodes_from_text(Path(item["key"]), item.pop("text"), _parser, root=RAW_DIR)
+
+def stage_worker(name, func, in_queue, out_queue, materialize_dir):
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+        if item["error"] is None:
+            item["sizes"][name] = len(item.get("text", ""))
+            start = time.perf_counter()
+            try:
+                func(item, materialize_dir)
+            except Exception as e:
+                item["error"] = f"{name}: {repr(e)}"
+            item["busy"][name] = time.perf_counter() - start
+        out_queue.put(item)
+
+# ===== Process cha =====
+
+class StageStats:
+    def __init__(self):
+        self.items = defaultdict(int)
+        self.busy = defaultdict(float)
+        self.chars = defaultdict(int)
+
+    def add(self, item):
+        for stage, seconds in item["busy"].items():
+            self.items[stage] += 1
+            self.busy[stage] += seconds
+            self.chars[stage] += item["sizes"].get(stage, 0)
+
+    def report(self, workers, wall):
+        lines = [f"📊 Throughput theo stage (wall {wall:.2f} giây):"]
+        for stage in STAGES:
+            if not self.items[stage]:
+                continue
+            busy, n = self.busy[stage], self.items[stage]
+            # busy/worker xấp xỉ thời gian wall stage đó chiếm → stage có tỉ lệ cao nhất là nút cổ chai
+            line = (f"   - {stage:<8} {n:>6} file | busy {busy:8.2f} giây / {workers[stage]} worker "
+                    f"→ {n / busy if busy else 0:8.1f} file/s/worker | tải {busy / workers[stage] / wall:5.0%}")
+            if self.chars[stage]:
+                line += f" | {self.chars[stage] / 1e6:.1f} M ký tự vào"
+            lines.append(line)
+        return "\n".join(lines)
+
+def get_result(out_queue, processes):
+    # Chờ kết quả stage cuối; process stage chết (OOM, segfault trong thư viện PDF...) → dừng thay vì treo mãi
+    while True:
+        try:
+            return out_queue.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            dead = [proc for proc, _ in processes if not proc.is_alive()]
+            if dead:
+                raise RuntimeError(f"process stage {dead[0].name} đã dừng bất thường (exitcode {dead[0].exitcode})")
+
+def scan_raw_files():
+    files = sorted(f for f in RAW_DIR.rglob("*") if f.is_file() and f.suffix.lower() in VALID_EXTS)
+    return [(f, f.relative_to(RAW_DIR)) for f in files]
+
+def start_stages(workers, queue_size, materialize_dir):
+    queues = [mp.Queue(maxsize=queue_size) for _ in range(4)]
+    processes = []
+    for i, (name, func) in enumerate([("extract", extract_stage), ("clean", clean_stage), ("chunk", chunk_stage)]):
+        for j in range(workers[name]):
+            proc = mp.Process(target=stage_worker, args=(name, func, queues[i], queues[i + 1], materialize_dir),
+                              name=f"{name}-{j}", daemon=True)
+            proc.start()
+            processes.append((proc, queues[i]))
+    return queues, processes
+
+def run(embed_model=None, force=False, materialize_dir=None, queue_size=QUEUE_SIZE,
+        extract_workers=EXTRACT_WORKERS, clean_workers=CLEAN_WORKERS, chunk_workers=CHUNK_WORKERS):
+    workers = {"extract": extract_workers, "clean": clean_workers, "chunk": chunk_workers, "embed": 1}
+    # Fork các process stage trước khi load embedding model / index: process con không thừa hưởng
+    # bộ nhớ của chúng (và trạng thái thread của torch); chúng chờ việc ở queue tới khi feeder chạy
+    queues, processes = start_stages(workers, queue_size, materialize_dir)
+    try:
+        ingest(embed_model, force, workers, queues, processes)
+    except BaseException:
+        for proc, _ in processes:
+            proc.terminate()
+        raise
+
+def ingest(embed_model, force, workers, queues, processes):
+    if embed_model is None:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        embed_model = HuggingFaceEmbedding(model_name=di.EMBEDDING_MODEL_NAME, embed_batch_size=di.EMBED_BATCH_SIZE)
+    cache = EmbeddingCache(di.EMBED_CACHE_PATH, embed_model.model_name)
+    index, rebuilt = di.load_or_create_index(embed_model, force)
+    bm25 = di.load_or_create_bm25(index, rebuilt)
+    dedup = di.load_or_create_dedup(index, rebuilt)
+    old_cache, node_map = di.load_previous_state(rebuilt)
+
+    # Phát hiện thay đổi theo hash của file gốc; file trùng nội dung chỉ index một lần
+    new_cache, seen_hashes, files, jobs, duplicates = {}, {}, {}, [], 0
+    for path, rel_path in scan_raw_files():
+        key, file_hash = file_key(rel_path), get_file_hash(path)
+        if file_hash in seen_hashes:
+            duplicates += 1
+            continue
+        seen_hashes[file_hash] = key
+        new_cache[key] = file_hash
+        files[key] = {"path": path, "rel_path": rel_path, "key": key, "error": None, "busy": {}, "sizes": {}}
+        if old_cache.get(key) != file_hash:
+            jobs.append(files[key])
+    removed = [key for key in node_map if key not in new_cache]
+
+    print(f"📁 Tổng số file gốc: {len(new_cache) + duplicates} ({duplicates} file trùng nội dung)")
+    print(f"🆕 File mới/thay đổi: {len(jobs)} | 🗑️ File đã xóa: {len(removed)}")
+
+    removed_nodes, reindex = di.remove_files(index, bm25, node_map, removed + [job["key"] for job in jobs], dedup)
+    if removed_nodes:
+        print(f"🧽 Đã xóa {removed_nodes} node cũ khỏi index.")
+    reindex = [files[key] for key in sorted(reindex) if key in files]
+    if reindex:
+        print(f"🔗 Index lại {len(reindex)} file có chunk trùng với node vừa bị xóa.")
+        jobs += reindex
+
+    # Thread riêng đẩy việc vào stage đầu: put() chặn khi queue đầy, trong lúc process cha vẫn embed
+    feeder = threading.Thread(target=lambda: [queues[0].put(job) for job in jobs], daemon=True)
+    feeder.start()
+
+    stats = StageStats()
+    pending, pending_count, failed = [], 0, 0
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal pending, pending_count
+        t0 = time.perf_counter()
+        try:
+            di.flush_nodes(index, bm25, embed_model, cache, pending, node_map, dedup)
+        except Exception as e:
+            print(f"❌ Lỗi khi embed lô {len(pending)} file: {e}")
+            for key, _ in pending:
+                new_cache.pop(key, None)
+        # Thời gian embed của cả lô chia đều cho các file trong lô
+        for _ in pending:
+            stats.add({"busy": {"embed": (time.perf_counter() - t0) / len(pending)}, "sizes": {}})
+        pending, pending_count = [], 0
+
+    for _ in tqdm(range(len(jobs)), desc="🚚 Ingest", ncols=100):
+        try:
+            item = get_result(queues[-1], processes)
+        except RuntimeError as e:
+            print(f"❌ {e} → hủy lượt ingest, index hiện tại giữ nguyên.")
+            cache.close()
+            raise
+        stats.add(item)
+        if item["error"] is not None:
+            print(f"❌ Lỗi khi xử lý {item['rel_path']}: {item['error']}")
+            new_cache.pop(item["key"], None)  # không ghi hash → lần sau thử lại
+            failed += 1
+            continue
+        pending.append((item["key"], item["nodes"]))
+        pending_count += len(item["nodes"])
+        if pending_count >= di.INGEST_BATCH_SIZE:
+            flush()
+    if pending:
+        flush()
+    wall = time.perf_counter() - start
+
+    for proc, in_queue in processes:
+        in_queue.put(None)
+    for proc, _ in processes:
+        proc.join()
+
+    print(f"🧠 Embedding cache: {cache.hits} hit / {cache.misses} miss")
+    if dedup is not None:
+        print(f"🧬 Gộp {dedup.collapsed} chunk gần trùng (MinHash, Jaccard >= {di.DEDUP_THRESHOLD})")
+    cache.close()
+    di.persist_all(index, bm25, new_cache, node_map, dedup, changed=rebuilt or new_cache != old_cache)
+    if jobs:
+        print(stats.report(workers, wall))
+        print(f"🚀 {len(jobs) - failed}/{len(jobs)} file trong {wall:.2f} giây → {len(jobs) / wall:.1f} file/s")
+    print("✅ Hoàn tất ingest.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest một lượt: file gốc → index (extract → clean → chunk → embed)")
+    parser.add_argument("--force", action="store_true", help="build lại toàn bộ index")
+    parser.add_argument("--materialize", nargs="?", const=str(MATERIALIZE_DIR), default=None,
+                        help=f"ghi text sau extract/clean ra thư mục để debug (mặc định {MATERIALIZE_DIR})")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--extract-workers", type=int, default=EXTRACT_WORKERS)
+    parser.add_argument("--clean-workers", type=int, default=CLEAN_WORKERS)
+    parser.add_argument("--chunk-workers", type=int, default=CHUNK_WORKERS)
+    args = parser.parse_args()
+    run(force=args.force or di.FORCE_REINDEX, materialize_dir=args.materialize, queue_size=args.queue_size,
+        extract_workers=args.extract_workers, clean_workers=args.clean_workers, chunk_workers=args.chunk_workers)
@@ -1,15 +1,15 @@
 # loadmodel.py
 
 import os
-import torch
-from huggingface_hub import snapshot_download
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from llama_index.llms.huggingface import HuggingFaceLLM
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core.settings import Settings
 from config import Config
 
+# Các thư viện nặng được import trong từng hàm để chatbot có thể load chúng song song trên nhiều thread
+
 def load_model_and_tokenizer(hf_token: str):
+    import torch
+    from huggingface_hub import snapshot_download
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
     if not os.path.exists(os.path.join(Config.MODEL_DIR, "config.json")):
         print(f"⬇️ Đang tải mô hình từ Hugging Face: {Config.MODEL_REPO}...")
         snapshot_download(repo_id=Config.MODEL_REPO, local_dir=Config.MODEL_DIR, token=hf_token)
@@ -24,20 +24,44 @@ def load_model_and_tokenizer(hf_token: str):
     )
     return model, tokenizer
 
+def generate_kwargs(tokenizer):
+    return {
+        "do_sample": True,
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "repetition_penalty": 1.2,
+        "pad_token_id": tokenizer.pad_token_id  # dùng đúng token đã gán
+    }
+
 def setup_llm(model, tokenizer):
+    from llama_index.llms.huggingface import HuggingFaceLLM
+
     return HuggingFaceLLM(
         model=model,
         tokenizer=tokenizer,
-        context_window=4096,
-        max_new_tokens=256,
-        generate_kwargs={
-            "do_sample": True,
-            "temperature": 0.7,
-            "top_p": 0.9,
-            "repetition_penalty": 1.2,
-            "pad_token_id": tokenizer.pad_token_id  # dùng đúng token đã gán
-        }
+        context_window=Config.CONTEXT_WINDOW,
+        max_new_tokens=Config.GEN_MAX_NEW_TOKENS,
+        generate_kwargs=generate_kwargs(tokenizer)
+    )
+
+def setup_scheduler(model, tokenizer, prefix_ids=None):
+    # Dùng chung trọng số với HuggingFaceLLM, chỉ gom nhiều prompt vào một lần model.generate
+    from generation_scheduler import GenerationScheduler
+    from prompt_builder import PrefixKVCache
+
+    return GenerationScheduler(
+        model,
+        tokenizer,
+        max_batch_size=Config.GEN_MAX_BATCH_SIZE,
+        window_ms=Config.GEN_BATCH_WINDOW_MS,
+        max_new_tokens=Config.GEN_MAX_NEW_TOKENS,
+        generate_kwargs=generate_kwargs(tokenizer),
+        prefix_cache=PrefixKVCache(model, prefix_ids) if prefix_ids else None
     )
 
 def setup_embed_model():
-    Settings.embed_model = HuggingFaceEmbedding(model_name=Config.EMBED_MODEL)
\ No newline at end of file
+    from llama_index.core.settings import Settings
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    Settings.embed_model = HuggingFaceEmbedding(model_name=Config.EMBED_MODEL)
+    return Settings.embed_model
\ No newline at end of file
@@ -0,0 +1,91 @@
+# loadtest.py
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+DEFAULT_QUESTIONS = [
+    "Quy trình triển khai thiết bị cho đơn vị nội bộ tại Datacenter?",
+    "Cách quy hoạch rack tại Datacenter?",
+    "Làm sao để thay pin UPS Eaton 9130?",
+    "How do I install an NX range cabinet?",
+    "Quy trình qtdc10 gồm những bước nào?",
+]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+async def send_query(host, port, question, stream):
+    path = "/query/stream" if stream else "/query"
+    body = json.dumps({"question": question}, ensure_ascii=False).encode("utf-8")
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    first_byte = time.perf_counter() - start
+    status = int(status_line.split()[1])
+    # Với SSE, thời điểm nhận token đầu tiên (hoặc answer nếu lấy từ cache) mới là TTFT có ý nghĩa
+    await reader.readuntil(b"\r\n\r\n")
+    if stream and status == 200:
+        while True:
+            event = await reader.readuntil(b"\n\n")
+            if event.startswith((b"event: token", b"event: answer", b"event: done")):
+                break
+        first_byte = time.perf_counter() - start
+    await reader.read()
+    writer.close()
+    return status, first_byte, time.perf_counter() - start
+
+async def run(args):
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(random.choice(DEFAULT_QUESTIONS) if args.random else DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)])
+    results = []
+
+    async def client():
+        while not queue.empty():
+            question = queue.get_nowait()
+            try:
+                results.append(await send_query(args.host, args.port, question, args.stream))
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                results.append((0, 0.0, 0.0))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r[0] == 200]
+    rejected = sum(1 for r in results if r[0] == 503)
+    failed = len(results) - len(ok) - rejected
+    latencies = [r[2] for r in ok]
+    first_bytes = [r[1] for r in ok]
+
+    print(f"📈 {len(results)} request, concurrency={args.concurrency}, {elapsed:.2f} giây")
+    print(f"   ✅ 200: {len(ok)} | 🚦 503 (backpressure): {rejected} | ❌ lỗi: {failed}")
+    print(f"   ⚡ Throughput: {len(ok) / elapsed:.2f} req/s")
+    print(f"   ⏱️ Latency p50/p95/p99: {percentile(latencies, 50):.2f} / "
+          f"{percentile(latencies, 95):.2f} / {percentile(latencies, 99):.2f} giây")
+    if args.stream:
+        print(f"   🚀 Time-to-first-token p50/p95: {percentile(first_bytes, 50):.2f} / "
+              f"{percentile(first_bytes, 95):.2f} giây")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test cục bộ cho IDC chatbot API (server.py)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--stream", action="store_true", help="dùng /query/stream (SSE)")
+    parser.add_argument("--random", action="store_true", help="chọn câu hỏi ngẫu nhiên thay vì xoay vòng")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,161 @@
+# metrics.py
+
+import os
+import json
+import time
+import uuid
+import random
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+STAGES = [
+    "lang_detect", "query_embed", "cache_lookup", "route", "vector_retrieve", "bm25_retrieve", "fusion",
+    "rerank", "prompt_build", "ttft", "generate", "cleanup", "total",
+]
+QUANTILES = (50, 95, 99)
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+class MetricsRegistry:
+    """
+    Kho histogram trong process: mỗi giai đoạn giữ `window` mẫu gần nhất để tính p50/p95/p99,
+    cùng tổng và số lần (tích lũy) để xuất Prometheus. Xuất thêm từng lượt hỏi ra JSONL.
+    """
+
+    def __init__(self, window=2048, jsonl_path=None, prom_path=None, profile_dir=None, profile_sample_rate=0.0):
+        self.window = window
+        self.samples = {}
+        self.sums = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()  # ghi file .prom: tạo nội dung + ghi + đổi tên là một khối
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.prom_path = Path(prom_path) if prom_path else None
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.profile_sample_rate = profile_sample_rate
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            self.sums[stage] = self.sums.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def start_turn(self, question=""):
+        sampled = self.profile_dir is not None and random.random() < self.profile_sample_rate
+        return Trace(self, question, profile=sampled)
+
+    def summary(self):
+        with self.lock:
+            result = {}
+            for stage in sorted(self.samples, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+                values = sorted(self.samples[stage])
+                result[stage] = {f"p{q}": _percentile(values, q) for q in QUANTILES}
+                result[stage]["count"] = self.counts[stage]
+            return result
+
+    def report(self):
+        lines = ["📊 Độ trễ theo giai đoạn (ms):   p50      p95      p99   số lần"]
+        for stage, stats in self.summary().items():
+            lines.append(f"   - {stage:<16}{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} "
+                         f"{stats['p99'] * 1000:>8.1f} {stats['count']:>8}")
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP idc_chatbot_stage_seconds Thời gian từng giai đoạn xử lý câu hỏi",
+            "# TYPE idc_chatbot_stage_seconds summary",
+        ]
+        summary = self.summary()
+        with self.lock:
+            for stage, stats in summary.items():
+                for q in QUANTILES:
+                    lines.append(f'idc_chatbot_stage_seconds{{stage="{stage}",quantile="{q / 100}"}} {stats[f"p{q}"]:.6f}')
+                lines.append(f'idc_chatbot_stage_seconds_sum{{stage="{stage}"}} {self.sums[stage]:.6f}')
+                lines.append(f'idc_chatbot_stage_seconds_count{{stage="{stage}"}} {self.counts[stage]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, record):
+        # Lỗi ghi metrics (đĩa đầy, thư mục bị xóa...) chỉ in cảnh báo, không được làm hỏng lượt hỏi
+        try:
+            if self.jsonl_path is not None:
+                self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if self.prom_path is not None:
+                # Ghi file tạm rồi đổi tên để node_exporter (textfile collector) không đọc phải file dở;
+                # tên tạm riêng từng thread để không process/thread nào đổi tên mất file của nhau
+                self.prom_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.export_lock:
+                    tmp = self.prom_path.with_name(f"{self.prom_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                    tmp.write_text(self.to_prometheus(), encoding="utf-8")
+                    os.replace(tmp, self.prom_path)
+        except Exception as e:
+            print(f"⚠️ Không ghi được metrics: {repr(e)}")
+
+class Trace:
+    """
+    Các span của một lượt hỏi. Span có thể đến từ nhiều thread (retrieve và generate
+    chạy trên executor khác nhau trong server) nên ghi qua lock của registry.
+    """
+
+    def __init__(self, registry, question="", profile=False):
+        self.registry = registry
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.question = question
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = {}
+        self.profile = profile
+        self.finished = False
+
+    def add(self, stage, seconds):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+        self.registry.observe(stage, seconds)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def profiled(self, part):
+        # cProfile chỉ theo dõi thread hiện tại → bật riêng cho từng phần (prepare/generate)
+        if not self.profile:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.registry.profile_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(self.registry.profile_dir / f"turn-{self.turn_id}-{part}.prof"))
+
+    def finish(self, **extra):
+        if self.finished:
+            return
+        self.finished = True
+        self.add("total", time.perf_counter() - self.started)
+        record = {"turn_id": self.turn_id, "ts": self.timestamp, "question": self.question,
+                  "spans_ms": {k: round(v * 1000, 2) for k, v in self.spans.items()}}
+        record.update(extra)
+        self.registry.export(record)
+
+    def breakdown(self):
+        return " | ".join(f"{stage} {self.spans[stage] * 1000:.0f}ms"
+                          for stage in STAGES if stage in self.spans and stage != "total")
+
+def span(trace, stage):
+    return trace.span(stage) if trace is not None else nullcontext()
@@ -0,0 +1,379 @@
+# numpy_vector_store.py
+
+import os
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from ann_index import IVFIndex, ids_fingerprint
+from quantization import QuantizedCodes
+
+VECTORS_FNAME = "vectors.npy"
+TABLE_FNAME = "vector_table.json"
+SCAN_BLOCK_ROWS = 65536  # số dòng mỗi lần nhân ma trận khi quét toàn bộ, giữ RAM tạm thời cố định
+DEFAULT_PARTITION_KEY = "doc_type"
+
+def _atomic_write_json(data, path: Path) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _atomic_save_npy(array: np.ndarray, path: Path) -> None:
+    tmp = path.with_suffix(".tmp.npy")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+def _match_filters(metadata: dict, filters: MetadataFilters) -> bool:
+    results = []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            results.append(_match_filters(metadata, f))
+            continue
+        value = metadata.get(f.key)
+        if f.operator == FilterOperator.EQ:
+            results.append(value == f.value)
+        elif f.operator == FilterOperator.NE:
+            results.append(value != f.value)
+        elif f.operator == FilterOperator.IN:
+            results.append(value in f.value)
+        elif f.operator == FilterOperator.NIN:
+            results.append(value not in f.value)
+        else:
+            raise ValueError(f"Toán tử filter chưa hỗ trợ: {f.operator}")
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store lưu embedding thành một ma trận .npy liền khối (float32/float16, đã chuẩn hóa L2)
+    cùng bảng id/metadata riêng. Khi load ở chế độ mmap, ma trận không bị đọc hết vào RAM;
+    top-k được tính bằng một phép nhân ma trận + argpartition.
+
+    Các dòng được phân vùng theo metadata `partition_key` (mặc định doc_type): khi persist, mỗi
+    phân vùng nằm thành một khối liền nhau trong vectors.npy, nên filter EQ/IN trên khóa này chỉ
+    quét đúng khối đó (đọc tuần tự qua mmap) thay vì duyệt metadata từng dòng.
+
+    `quantization` = "int8" | "binary": quét trên bản nén (nạp vào RAM) để lấy shortlist
+    `rescore_factor`·k dòng, rồi chấm lại chính xác trên vectors.npy (mmap, chỉ đọc các dòng shortlist).
+    Có cả ANN thì chỉ các dòng trong những list IVF được probe mới được chấm trên bản nén.
+    """
+
+    stores_text: bool = False
+    flat_metadata: bool = True
+    dtype: str = "float32"
+    nprobe: int = 8  # số list IVF được quét khi có ANN; tăng để tăng recall
+    partition_key: str = DEFAULT_PARTITION_KEY
+    quantization: str = "none"
+    rescore_factor: int = 4
+
+    _ann: Any = PrivateAttr(default=None)
+    _codes: Any = PrivateAttr(default=None)
+    _vectors: Any = PrivateAttr(default=None)    # luôn là _buffer[:size] khi _buffer khác None
+    _buffer: Any = PrivateAttr(default=None)     # ma trận trong RAM có dư chỗ (dung lượng tăng gấp đôi)
+    _rows_stale: bool = PrivateAttr(default=False)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[dict] = PrivateAttr(default_factory=list)
+    _id_to_row: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _partition_rows: Dict[str, np.ndarray] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, dtype: str = "float32", nprobe: int = 8, partition_key: str = DEFAULT_PARTITION_KEY,
+                 **kwargs: Any) -> None:
+        super().__init__(dtype=dtype, nprobe=nprobe, partition_key=partition_key, **kwargs)
+        self._vectors = np.zeros((0, 0), dtype=dtype)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @staticmethod
+    def exists(persist_dir) -> bool:
+        persist_dir = Path(persist_dir)
+        return (persist_dir / VECTORS_FNAME).exists() and (persist_dir / TABLE_FNAME).exists()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, mmap: bool = True, use_ann: bool = True, nprobe: int = 8,
+                         quantization: str = "none", rescore_factor: int = 4) -> "NumpyVectorStore":
+        persist_dir = Path(persist_dir)
+        with open(persist_dir / TABLE_FNAME, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        store = cls(dtype=table["dtype"], nprobe=nprobe,
+                    partition_key=table.get("partition_key", DEFAULT_PARTITION_KEY),
+                    quantization=quantization, rescore_factor=rescore_factor)
+        store._vectors = np.load(persist_dir / VECTORS_FNAME, mmap_mode="r" if mmap else None)
+        store._ids = table["ids"]
+        store._ref_doc_ids = table["ref_doc_ids"]
+        store._metadata = table["metadata"]
+        store._reindex_rows()
+        if use_ann and IVFIndex.exists(persist_dir):
+            ann = IVFIndex.load(persist_dir, mmap=mmap)
+            if ann.fingerprint == ids_fingerprint(store._ids):
+                store._ann = ann
+            else:
+                print("⚠️ ANN index không khớp với vectors.npy → dùng tìm kiếm chính xác.")
+        if quantization != "none":
+            if not QuantizedCodes.exists(persist_dir, quantization):
+                print(f"⚠️ Chưa có mã lượng tử hóa {quantization} → dùng vector float (chạy lại data_indexing.py).")
+            else:
+                codes = QuantizedCodes.load(persist_dir, quantization)
+                if codes.fingerprint == ids_fingerprint(store._ids):
+                    store._codes = codes
+                else:
+                    print(f"⚠️ Mã lượng tử hóa {quantization} không khớp với vectors.npy → dùng vector float.")
+        return store
+
+    @property
+    def size(self) -> int:
+        # Không định nghĩa __len__: StorageContext kiểm tra `if vector_store:` nên store rỗng sẽ bị bỏ qua
+        return len(self._ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors
+
+    @property
+    def ids(self) -> List[str]:
+        return self._ids
+
+    @property
+    def ann(self) -> Optional[IVFIndex]:
+        return self._ann
+
+    @property
+    def codes(self) -> Optional[QuantizedCodes]:
+        return self._codes
+
+    @property
+    def partitions(self) -> Dict[str, int]:
+        # Giá trị phân vùng → số dòng; "" là các dòng không có metadata `partition_key`
+        self._ensure_rows()
+        return {value: len(rows) for value, rows in self._partition_rows.items()}
+
+    def partition_node_ids(self, values) -> set:
+        self._ensure_rows()
+        return {self._ids[row] for value in values for row in self._partition_rows.get(value, ())}
+
+    def _reindex_rows(self) -> None:
+        # Mọi thay đổi dòng đều làm ANN / mã lượng tử hóa cũ mất hiệu lực. Bảng id → dòng và phân vùng
+        # chỉ dựng lại khi cần đọc (O(N) bằng Python): nhiều lần add liên tiếp lúc ingest không phải trả giá này
+        self._ann = None
+        self._codes = None
+        self._rows_stale = True
+
+    def _ensure_rows(self) -> None:
+        if not self._rows_stale:
+            return
+        self._rows_stale = False
+        self._id_to_row = {node_id: row for row, node_id in enumerate(self._ids)}
+        partition_rows: Dict[str, list] = {}
+        for row, metadata in enumerate(self._metadata):
+            partition_rows.setdefault(str(metadata.get(self.partition_key, "")), []).append(row)
+        self._partition_rows = {value: np.asarray(rows, dtype=np.int64) for value, rows in partition_rows.items()}
+
+    def _sort_by_partition(self) -> None:
+        # Gom mỗi phân vùng thành khối dòng liền nhau (giữ thứ tự cũ trong từng phân vùng)
+        self._ensure_rows()
+        order = np.concatenate([self._partition_rows[v] for v in sorted(self._partition_rows)]) \
+            if self._partition_rows else np.zeros(0, dtype=np.int64)
+        if np.array_equal(order, np.arange(len(self._ids))):
+            return
+        self._vectors = self._buffer = np.asarray(self._vectors)[order]
+        self._ids = [self._ids[i] for i in order]
+        self._ref_doc_ids = [self._ref_doc_ids[i] for i in order]
+        self._metadata = [self._metadata[i] for i in order]
+        self._reindex_rows()
+
+    def _partition_filter_rows(self, filters: MetadataFilters) -> Optional[np.ndarray]:
+        """Các dòng thỏa filter nếu filter chỉ gồm EQ/IN trên `partition_key` (nối bằng AND), ngược lại None."""
+        if filters.condition == FilterCondition.OR and len(filters.filters) > 1:
+            return None
+        allowed = None
+        for f in filters.filters:
+            if isinstance(f, MetadataFilters) or f.key != self.partition_key:
+                return None
+            if f.operator == FilterOperator.EQ:
+                values = {str(f.value)}
+            elif f.operator == FilterOperator.IN:
+                values = {str(v) for v in f.value}
+            else:
+                return None
+            allowed = values if allowed is None else allowed & values
+        self._ensure_rows()
+        rows = [self._partition_rows[v] for v in sorted(allowed or ()) if v in self._partition_rows]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        new_vectors = self._normalize(np.asarray([n.get_embedding() for n in nodes], dtype=np.float32))
+        new_vectors = new_vectors.astype(self.dtype)
+        n, need = len(self._ids), len(self._ids) + len(new_vectors)
+        buffer = self._buffer
+        if buffer is None or len(buffer) < need or buffer.shape[1] != new_vectors.shape[1]:
+            # Hết chỗ (hoặc ma trận đang mmap chỉ đọc) → cấp phát gấp đôi, chép một lần: add có chi phí O(1) khấu hao
+            buffer = np.empty((max(need, 2 * n, 1024), new_vectors.shape[1]), dtype=self.dtype)
+            if n:
+                buffer[:n] = self._vectors
+            self._buffer = buffer
+        buffer[n:need] = new_vectors
+        self._vectors = buffer[:need]
+
+        for node in nodes:
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+            # Chỉ giữ metadata dạng scalar để lọc, phần còn lại đã nằm trong docstore
+            self._metadata.append({
+                k: v for k, v in node.metadata.items() if isinstance(v, (str, int, float, bool))
+            })
+        self._reindex_rows()
+        return [node.node_id for node in nodes]
+
+    def _drop_rows(self, drop: np.ndarray) -> None:
+        if not drop.any():
+            return
+        keep = ~drop
+        if self._buffer is None:
+            self._vectors = self._buffer = np.asarray(self._vectors)[keep]
+        else:
+            # Dồn tại chỗ trong buffer, chỉ chép phần sau dòng bị xóa đầu tiên
+            first = int(np.argmax(drop))
+            tail = first + np.flatnonzero(keep[first:])
+            self._buffer[first:first + len(tail)] = self._buffer[tail]
+            self._vectors = self._buffer[:first + len(tail)]
+        self._ids = [x for x, k in zip(self._ids, keep) if k]
+        self._ref_doc_ids = [x for x, k in zip(self._ref_doc_ids, keep) if k]
+        self._metadata = [x for x, k in zip(self._metadata, keep) if k]
+        self._reindex_rows()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._drop_rows(np.array([r == ref_doc_id for r in self._ref_doc_ids], dtype=bool))
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        self._ensure_rows()
+        drop = np.zeros(len(self._ids), dtype=bool)
+        for node_id in node_ids or []:
+            row = self._id_to_row.get(node_id)
+            if row is not None:
+                drop[row] = True
+        if filters is not None:
+            drop |= np.array([_match_filters(m, filters) for m in self._metadata], dtype=bool)
+        self._drop_rows(drop)
+
+    def _candidate_rows(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        # None = quét toàn bộ ma trận
+        mask = None
+        if query.node_ids:
+            self._ensure_rows()
+            mask = np.zeros(len(self._ids), dtype=bool)
+            rows = [self._id_to_row[i] for i in query.node_ids if i in self._id_to_row]
+            mask[rows] = True
+        if query.doc_ids:
+            doc_ids = set(query.doc_ids)
+            doc_mask = np.array([r in doc_ids for r in self._ref_doc_ids], dtype=bool)
+            mask = doc_mask if mask is None else mask & doc_mask
+        if query.filters is not None:
+            partition_rows = self._partition_filter_rows(query.filters)
+            if partition_rows is not None and mask is None:
+                return partition_rows
+            if partition_rows is not None:
+                filter_mask = np.zeros(len(self._ids), dtype=bool)
+                filter_mask[partition_rows] = True
+            else:
+                filter_mask = np.array([_match_filters(m, query.filters) for m in self._metadata], dtype=bool)
+            mask = filter_mask if mask is None else mask & filter_mask
+        return None if mask is None else np.flatnonzero(mask)
+
+    def _score_all(self, q: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self._ids), dtype=np.float32)
+        for start in range(0, len(self._ids), SCAN_BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ q
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            raise ValueError("NumpyVectorStore cần query_embedding.")
+        if len(self._ids) == 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = self._normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        rows = self._candidate_rows(query)
+        if rows is None and self._ann is not None:
+            if self._codes is None:
+                top_rows, top_scores = self._ann.search(self._vectors, q, query.similarity_top_k, self.nprobe)
+                return VectorStoreQueryResult(
+                    nodes=None,
+                    similarities=top_scores.tolist(),
+                    ids=[self._ids[r] for r in top_rows],
+                )
+            # IVF chọn các list cần quét, codes chấm xấp xỉ trong các list đó rồi rescore trên vector float
+            rows = self._ann.probe(q, query.similarity_top_k, self.nprobe)
+        if self._codes is not None:
+            top_rows, top_scores = self._codes.search(
+                self._vectors, q, query.similarity_top_k, query.similarity_top_k * self.rescore_factor, rows)
+            return VectorStoreQueryResult(
+                nodes=None,
+                similarities=top_scores.tolist(),
+                ids=[self._ids[r] for r in top_rows],
+            )
+        if rows is None:
+            scores = self._score_all(q)
+            rows = np.arange(len(self._ids))
+        elif len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            # Một phân vùng liền khối → đọc một lát cắt liên tục thay vì fancy-index từng dòng
+            scores = np.asarray(self._vectors[rows[0]:rows[-1] + 1], dtype=np.float32) @ q
+        else:
+            scores = np.asarray(self._vectors[rows], dtype=np.float32) @ q
+
+        k = min(query.similarity_top_k, len(rows))
+        if k == 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=scores[top].tolist(),
+            ids=[self._ids[rows[i]] for i in top],
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # StorageContext truyền vào đường dẫn file JSON mặc định → lưu cạnh nó trong cùng thư mục
+        persist_dir = Path(persist_path).parent
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        self._sort_by_partition()
+        _atomic_save_npy(np.ascontiguousarray(self._vectors, dtype=self.dtype), persist_dir / VECTORS_FNAME)
+        _atomic_write_json({
+            "dtype": self.dtype,
+            "partition_key": self.partition_key,
+            "partitions": {v: [int(rows[0]), int(rows[-1]) + 1] for v, rows in self._partition_rows.items()},
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+        }, persist_dir / TABLE_FNAME)
@@ -0,0 +1,108 @@
+# prompt_builder.py
+
+import copy
+from dataclasses import dataclass, field
+from typing import List
+
+# Phần cố định đứng đầu prompt → past_key_values của nó chỉ cần tính một lần (PrefixKVCache)
+SYSTEM_INSTRUCTIONS = (
+    "Bạn là trợ lý AI trả lời câu hỏi dựa trên tài liệu nội bộ. Trả lời chính xác theo dữ liệu.\n"
+    "Nếu không chắc chắn, hãy nói rõ là chưa tìm thấy trong dữ liệu.\n\n"
+    "Tài liệu tham khảo:\n"
+)
+PASSAGE_TEMPLATE = "[{i}] {text}\n\n"
+QUESTION_TEMPLATE = "Câu hỏi: {question}\n"
+
+@dataclass
+class Prompt:
+    text: str                     # dùng khi gọi thẳng HuggingFaceLLM (không qua scheduler)
+    prefix_ids: List[int]         # token của SYSTEM_INSTRUCTIONS, giống hệt nhau mọi lượt
+    suffix_ids: List[int]         # đoạn văn + câu hỏi, phần duy nhất cần prefill mỗi lượt
+    passages: List[str] = field(default_factory=list)
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.prefix_ids) + len(self.suffix_ids)
+
+    @property
+    def context(self) -> str:
+        return "\n\n".join(self.passages)
+
+class PromptBuilder:
+    """
+    Ghép prompt theo thứ tự: hướng dẫn cố định → các đoạn văn đã rerank → câu hỏi.
+    Mỗi phần được tokenize riêng rồi nối id lại, nên số token đếm được đúng bằng số token đưa vào model:
+    ngân sách đoạn văn = context_window − prefix − câu hỏi − max_new_tokens.
+    Đoạn văn được xếp theo thứ tự rerank; đoạn không vừa phần còn lại thì bỏ qua để thử đoạn ngắn hơn,
+    riêng đoạn đầu tiên dài hơn cả ngân sách thì bị cắt theo token thay vì để prompt trống.
+    """
+
+    def __init__(self, tokenizer, context_window=4096, max_new_tokens=256, max_passages=None,
+                 instructions=SYSTEM_INSTRUCTIONS):
+        self.tokenizer = tokenizer
+        self.context_window = context_window
+        self.max_new_tokens = max_new_tokens
+        self.max_passages = max_passages
+        self.instructions = instructions
+        self.prefix_ids = list(tokenizer.encode(instructions, add_special_tokens=True))
+
+    def _encode(self, text):
+        return list(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def build(self, question, passages, max_new_tokens=None) -> Prompt:
+        question_text = QUESTION_TEMPLATE.format(question=question)
+        question_ids = self._encode(question_text)
+        # Giới hạn riêng chỉ được nhỏ hơn mặc định (scheduler cũng chặn như vậy), nếu không ngân sách đoạn văn âm
+        max_new_tokens = min(max_new_tokens or self.max_new_tokens, self.max_new_tokens)
+        room = self.context_window - len(self.prefix_ids) - max_new_tokens
+        if len(question_ids) > room:
+            # Câu hỏi quá dài: giữ phần cuối (có "Câu hỏi:" bị mất nhưng không vượt context window)
+            question_ids = question_ids[len(question_ids) - max(room, 0):]
+            question_text = self.tokenizer.decode(question_ids)
+        budget = room - len(question_ids)
+
+        used, pieces, ids = [], [], []
+        for text in passages:
+            if self.max_passages is not None and len(used) >= self.max_passages:
+                break
+            piece = PASSAGE_TEMPLATE.format(i=len(used) + 1, text=text)
+            piece_ids = self._encode(piece)
+            if len(piece_ids) > budget:
+                if used or budget <= 0:
+                    continue
+                piece_ids = piece_ids[:budget]
+                piece = self.tokenizer.decode(piece_ids)
+                text = piece
+            used.append(text)
+            pieces.append(piece)
+            ids += piece_ids
+            budget -= len(piece_ids)
+        return Prompt(
+            text=self.instructions + "".join(pieces) + question_text,
+            prefix_ids=self.prefix_ids,
+            suffix_ids=ids + question_ids,
+            passages=used,
+        )
+
+class PrefixKVCache:
+    """
+    past_key_values của prefix cố định, tính một lần khi load model. Mỗi batch nhận một bản sao
+    (generate ghi thêm vào cache) được lặp theo số dòng của batch.
+    """
+
+    def __init__(self, model, prefix_ids):
+        import torch
+
+        self.prefix_ids = prefix_ids
+        with torch.no_grad():
+            output = model(torch.tensor([prefix_ids], device=model.device), use_cache=True)
+        self.past_key_values = output.past_key_values
+
+    def for_batch(self, batch_size):
+        past = copy.deepcopy(self.past_key_values)
+        if batch_size == 1:
+            return past
+        if hasattr(past, "batch_repeat_interleave"):  # DynamicCache
+            past.batch_repeat_interleave(batch_size)
+            return past
+        return tuple(tuple(t.repeat(batch_size, *([1] * (t.dim() - 1))) for t in layer) for layer in past)
@@ -0,0 +1,191 @@
+# quantization.py
+
+import sys
+import json
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+MODES = ("int8", "binary")
+CODES_FNAME = "codes_{mode}.npy"
+CODES_META_FNAME = "codes_{mode}.json"
+SCAN_BLOCK_ROWS = 65536
+CODE_BLOCK_ROWS = 1024  # khối int8 → float32 vừa cache L2, nhanh hơn ~2-3× so với đổi cả khối lớn
+# Bảng popcount cho numpy cũ (numpy >= 2.0 có sẵn np.bitwise_count)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+class QuantizedCodes:
+    """
+    Bản nén của vectors.npy để giữ trọn trong RAM, ma trận gốc vẫn nằm trên đĩa (mmap):
+    - "int8":   mỗi chiều lượng tử hóa tuyến tính về [-127, 127] với scale riêng từng chiều (4× nhỏ hơn float32),
+                điểm xấp xỉ = codes · (q ⊙ scale).
+    - "binary": chỉ giữ bit dấu, đóng gói bằng np.packbits (32× nhỏ hơn), điểm xấp xỉ = -hamming(codes, sign(q)).
+    Tìm kiếm lấy shortlist `rescore_k` dòng theo điểm xấp xỉ rồi chấm lại chính xác trên vector float.
+    """
+
+    def __init__(self, mode: str, codes: np.ndarray, scale: Optional[np.ndarray] = None, fingerprint: str = ""):
+        if mode not in MODES:
+            raise ValueError(f"Chế độ lượng tử hóa không hợp lệ: {mode} (chọn một trong {MODES})")
+        self.mode = mode
+        self.codes = codes
+        self.scale = scale        # chỉ dùng cho int8, shape (dim,)
+        self.fingerprint = fingerprint
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0))
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, mode: str, fingerprint: str = "") -> "QuantizedCodes":
+        n_rows, dim = vectors.shape
+        if mode == "binary":
+            codes = np.empty((n_rows, (dim + 7) // 8), dtype=np.uint8)
+            for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+                codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+            return cls(mode, codes, fingerprint=fingerprint)
+
+        # Lượt 1: biên độ lớn nhất từng chiều; lượt 2: lượng tử hóa (quét theo khối, không nạp hết ma trận)
+        max_abs = np.zeros(dim, dtype=np.float32)
+        for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+        scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        codes = np.empty((n_rows, dim), dtype=np.int8)
+        for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            codes[start:start + len(block)] = np.clip(np.rint(block / scale), -127, 127)
+        return cls(mode, codes, scale, fingerprint)
+
+    def approx_scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        if self.mode == "binary":
+            q_bits = np.packbits(q > 0)
+            for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                block = codes[start:start + SCAN_BLOCK_ROWS]
+                scores[start:start + len(block)] = -_popcount_rows(block ^ q_bits)
+            return scores
+        q_scaled = (q * self.scale).astype(np.float32)
+        for start in range(0, len(codes), CODE_BLOCK_ROWS):
+            # Đổi từng khối int8 sang float32 để dùng BLAS, RAM tạm thời cố định theo CODE_BLOCK_ROWS
+            block = codes[start:start + CODE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ q_scaled
+        return scores
+
+    def search(self, vectors: np.ndarray, q: np.ndarray, k: int, rescore_k: int,
+               rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        approx = self.approx_scores(q, rows)
+        if rows is None:
+            rows = np.arange(len(approx))
+        n = min(max(rescore_k, k), len(rows))
+        if n == 0:
+            return rows[:0], np.zeros(0, dtype=np.float32)
+        shortlist = np.sort(rows[np.argpartition(-approx, n - 1)[:n]])  # sắp xếp để đọc mmap tuần tự hơn
+        scores = np.asarray(vectors[shortlist], dtype=np.float32) @ q
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return shortlist[top], scores[top]
+
+    @staticmethod
+    def exists(persist_dir, mode: str) -> bool:
+        return (Path(persist_dir) / CODES_META_FNAME.format(mode=mode)).exists()
+
+    def save(self, persist_dir) -> None:
+        persist_dir = Path(persist_dir)
+        np.save(persist_dir / CODES_FNAME.format(mode=self.mode), self.codes)
+        with open(persist_dir / CODES_META_FNAME.format(mode=self.mode), "w", encoding="utf-8") as f:
+            json.dump({
+                "mode": self.mode,
+                "fingerprint": self.fingerprint,
+                "scale": self.scale.tolist() if self.scale is not None else None,
+            }, f)
+
+    @classmethod
+    def load(cls, persist_dir, mode: str, mmap: bool = False) -> "QuantizedCodes":
+        # Mặc định nạp hẳn vào RAM: đây là phần được quét mỗi truy vấn
+        persist_dir = Path(persist_dir)
+        with open(persist_dir / CODES_META_FNAME.format(mode=mode), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        scale = np.asarray(meta["scale"], dtype=np.float32) if meta["scale"] is not None else None
+        codes = np.load(persist_dir / CODES_FNAME.format(mode=mode), mmap_mode="r" if mmap else None)
+        return cls(mode, codes, scale, meta["fingerprint"])
+
+    @staticmethod
+    def remove(persist_dir, modes=MODES) -> None:
+        for mode in modes:
+            (Path(persist_dir) / CODES_FNAME.format(mode=mode)).unlink(missing_ok=True)
+            (Path(persist_dir) / CODES_META_FNAME.format(mode=mode)).unlink(missing_ok=True)
+
+def quantization_report(vectors: np.ndarray, codes_list: List[QuantizedCodes], k: int = 10,
+                        rescore_factor: int = 4, n_queries: int = 200, noise: float = 0.05,
+                        seed: int = 0) -> List[dict]:
+    """
+    Recall@k (trước và sau rescore) và bộ nhớ của từng chế độ so với tìm kiếm chính xác trên float,
+    cùng cách giả lập truy vấn như ann_index.recall_at_k: vector ngẫu nhiên trong index cộng nhiễu.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    kk = min(k, len(vectors))
+
+    exact = []
+    for q in queries:
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ q
+        exact.append(set(np.argpartition(-scores, kk - 1)[:kk].tolist()))
+
+    float_bytes = int(vectors.shape[0] * vectors.shape[1] * np.dtype(vectors.dtype).itemsize)
+    report = [{"mode": "none", "bytes": float_bytes, "recall_approx": 1.0, "recall": 1.0, "ms_per_query": None}]
+    for codes in codes_list:
+        hits_approx = hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            top, _ = codes.search(vectors, q, kk, kk * rescore_factor)
+            hits += len(truth & set(top.tolist()))
+        elapsed = time.perf_counter() - start
+        for q, truth in zip(queries, exact):
+            approx = codes.approx_scores(q)
+            hits_approx += len(truth & set(np.argpartition(-approx, kk - 1)[:kk].tolist()))
+        report.append({
+            "mode": codes.mode,
+            "bytes": codes.nbytes,
+            "recall_approx": hits_approx / (len(queries) * kk),
+            "recall": hits / (len(queries) * kk),
+            "ms_per_query": elapsed / len(queries) * 1000,
+        })
+    return report
+
+def format_report(report: List[dict], k: int, rescore_factor: int) -> str:
+    lines = [f"🗜️ Lượng tử hóa vector (recall@{k}, shortlist = {rescore_factor}×k rồi rescore trên float):"]
+    for row in report:
+        line = f"   - {row['mode']:<6} {row['bytes'] / 1e6:9.1f} MB trong RAM"
+        if row["mode"] != "none":
+            line += (f" ({report[0]['bytes'] / max(row['bytes'], 1):4.1f}× nhỏ hơn) | recall codes "
+                     f"{row['recall_approx']:.3f} → rescore {row['recall']:.3f} | {row['ms_per_query']:.2f} ms/truy vấn")
+        lines.append(line)
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # python quantization.py [storage_dir] → báo cáo recall/bộ nhớ trên vectors.npy đã index (snapshot CURRENT)
+    import snapshots
+
+    storage_dir = snapshots.resolve_storage_dir(sys.argv[1] if len(sys.argv) > 1 else "data/storage")
+    vectors = np.load(storage_dir / "vectors.npy", mmap_mode="r")
+    codes_list = [
+        QuantizedCodes.load(storage_dir, mode) if QuantizedCodes.exists(storage_dir, mode)
+        else QuantizedCodes.build(vectors, mode)
+        for mode in MODES
+    ]
+    print(format_report(quantization_report(vectors, codes_list), k=10, rescore_factor=4))
@@ -0,0 +1,54 @@
+# query_router.py
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+# Từ khóa/regex → phân vùng doc_type. Trọng số 2 cho tín hiệu gần như chắc chắn (mã quy trình, model thiết bị)
+DEFAULT_RULES = {
+    "procedure": [
+        (r"\bqtdc\s*\d*", 2), (r"quy trình", 1), (r"thủ tục", 1), (r"phê duyệt", 1), (r"biểu mẫu", 1),
+        (r"biên bản", 1), (r"đăng ký", 1), (r"trưởng ca", 1), (r"đơn vị nội bộ", 1), (r"\bprocedure", 1),
+    ],
+    "manual": [
+        (r"\beaton\b", 2), (r"\bnx\b", 2), (r"\bups\b", 1), (r"\bpdu\b", 1), (r"\bmanual\b", 2),
+        (r"hướng dẫn sử dụng", 2), (r"lắp đặt", 1), (r"\binstall", 1), (r"\bcabinet\b", 1), (r"\bbattery\b", 1),
+        (r"thay pin", 1), (r"firmware", 1), (r"thông số", 1), (r"\bmodel\b", 1),
+    ],
+}
+
+@dataclass
+class Route:
+    partitions: List[str] = field(default_factory=list)
+    mode: str = "none"  # "restrict": chỉ tìm trong partitions | "boost": ưu tiên partitions | "none"
+    scores: Dict[str, int] = field(default_factory=dict)
+
+class QueryRouter:
+    """
+    Bộ định tuyến rẻ bằng từ khóa: chấm điểm câu hỏi cho từng phân vùng doc_type.
+    Một phân vùng thắng rõ (>= restrict_min điểm, các phân vùng khác 0 điểm) → restrict;
+    chỉ nhỉnh hơn → boost; hòa hoặc không có tín hiệu → tìm trên toàn bộ index.
+    """
+
+    def __init__(self, rules=None, restrict_min: int = 2):
+        self.rules = {
+            partition: [(re.compile(pattern, flags=re.IGNORECASE), weight) for pattern, weight in patterns]
+            for partition, patterns in (rules or DEFAULT_RULES).items()
+        }
+        self.restrict_min = restrict_min
+
+    def route(self, question: str) -> Route:
+        scores = {
+            partition: sum(weight for pattern, weight in patterns if pattern.search(question))
+            for partition, patterns in self.rules.items()
+        }
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        best = ranked[0] if ranked else None
+        if best is None or scores[best] == 0:
+            return Route(scores=scores)
+        others = [scores[p] for p in ranked[1:]]
+        if scores[best] >= self.restrict_min and not any(others):
+            return Route([best], "restrict", scores)
+        if scores[best] > max(others, default=0):
+            return Route([best], "boost", scores)
+        return Route(scores=scores)
@@ -1,10 +1,15 @@
 import os
 import json
+import codecs
 import hashlib
 from pathlib import Path
 from PyPDF2 import PdfReader
 import docx
-from typing import List
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+# Tăng khi thay đổi logic trích xuất/tách node → manifest của data_refine.py coi output cũ là lỗi thời
+EXTRACTOR_VERSION = 2
 
 def get_file_hash(path: Path) -> str:
     hasher = hashlib.md5()
@@ -13,29 +18,41 @@ def get_file_hash(path: Path) -> str:
             hasher.update(chunk)
     return hasher.hexdigest()
 
-def extract_text_from_pdf(path: Path):
+def count_pdf_pages(path: Path) -> int:
+    with open(path, "rb") as file:
+        return len(PdfReader(file).pages)
+
+def extract_text_from_pdf(path: Path, chunk_chars: int = 100000, start: int = 0, end: Optional[int] = None):
+    # start/end: chỉ đọc các trang [start, end) → nhiều worker cùng tách một PDF lớn theo khoảng trang
     with open(path, "rb") as file:
         reader = PdfReader(file)
         pages_text = []
-        for page in reader.pages:
-            text = page.extract_text()
+        pending = 0  # đếm dồn thay vì join lại toàn bộ list ở mỗi trang (O(n²) với manual dài)
+        for i in range(start, len(reader.pages) if end is None else min(end, len(reader.pages))):
+            text = reader.pages[i].extract_text()
             if text:
                 pages_text.append(text)
-                if len("".join(pages_text)) > 100000:
+                pending += len(text)
+                if pending > chunk_chars:
                     yield "".join(pages_text)
                     pages_text = []
+                    pending = 0
         if pages_text:
             yield "".join(pages_text)
 
-def extract_text_from_docx(path: Path):
+def extract_text_from_docx(path: Path, chunk_chars: int = 100000):
     doc = docx.Document(path)
     paragraphs = []
+    pending = 0
     for para in doc.paragraphs:
         if para.text.strip():
             paragraphs.append(para.text)
-            if len("\n".join(paragraphs)) > 100000:
-                yield "\n".join(paragraphs)
+            pending += len(para.text) + 1
+            if pending > chunk_chars:
+                # Giữ ký tự xuống dòng ở ranh giới để đoạn cuối và đoạn đầu chunk sau không dính từ
+                yield "\n".join(paragraphs) + "\n"
                 paragraphs = []
+                pending = 0
     if paragraphs:
         yield "\n".join(paragraphs)
 
@@ -47,17 +64,47 @@ def extract_text_from_txt(path: Path) -> str:
         with open(path, "r", encoding="latin-1") as file:
             return file.read()
 
-def split_into_nodes(text: str, min_length: int = 500, max_length: int = 1500) -> List[str]:
-    words = text.split()
-    nodes = []
+def _detect_txt_encoding(path: Path, block_size: int = 1 << 20) -> str:
+    # Kiểm tra UTF-8 theo từng block (bộ nhớ cố định) trước khi stream, vì không thể đổi encoding giữa chừng
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8"
+
+def iter_text_from_txt(path: Path, chunk_chars: int = 100000):
+    with open(path, "r", encoding=_detect_txt_encoding(path)) as file:
+        for text in iter(lambda: file.read(chunk_chars), ""):
+            yield text
+
+def _iter_words(text_stream):
+    # Từ cuối của một chunk có thể bị cắt đôi → giữ lại và nối vào đầu chunk sau
+    tail = ""
+    for text in text_stream:
+        text = tail + text
+        words = text.split()
+        tail = words.pop() if words and not text[-1].isspace() else ""
+        yield from words
+    if tail:
+        yield tail
+
+def iter_nodes(text_stream, min_length: int = 500, max_length: int = 1500):
+    """
+    Bản streaming của split_into_nodes: nhận một iterable các đoạn text và trả từng node
+    ngay khi đủ dài. Kết quả giống hệt split_into_nodes("".join(text_stream)).
+    """
     current_node = []
     current_length = 0
 
-    for word in words:
+    for word in _iter_words(text_stream):
         if current_length + len(word) + 1 > max_length and current_node:
             node_text = " ".join(current_node)
             if len(node_text) >= min_length:
-                nodes.append(node_text)
+                yield node_text
                 current_node = [word]
                 current_length = len(word)
             else:
@@ -66,46 +113,75 @@ def split_into_nodes(text: str, min_length: int = 500, max_length: int = 1500) -
         else:
             current_node.append(word)
             current_length += len(word) + 1
-    
+
     if current_node:
         node_text = " ".join(current_node)
         if len(node_text) >= min_length:
-            nodes.append(node_text)
-    return [node.strip() for node in nodes if node.strip()]
+            yield node_text
 
-def extract_text_with_metadata(path: Path, doc_type: str) -> List[dict]:
-    documents = []
+def split_into_nodes(text: str, min_length: int = 500, max_length: int = 1500) -> List[str]:
+    return list(iter_nodes([text], min_length=min_length, max_length=max_length))
+
+def open_text_stream(path: Path) -> Optional[Iterator[str]]:
     if path.suffix.lower() == ".pdf":
-        text_stream = extract_text_from_pdf(path)
+        return extract_text_from_pdf(path)
     elif path.suffix.lower() == ".docx":
-        text_stream = extract_text_from_docx(path)
+        return extract_text_from_docx(path)
     elif path.suffix.lower() == ".txt":
-        text_stream = [extract_text_from_txt(path)]
-    else:
-        return []
-
-    for text_chunk in text_stream:
-        if text_chunk.strip():
-            nodes = split_into_nodes(text_chunk, min_length=500, max_length=1500)
-            documents.extend([{
-                "text": node,
+        return iter_text_from_txt(path)
+    return None
+
+def iter_documents(path: Path, doc_type: str, text_stream: Optional[Iterable[str]] = None) -> Iterator[dict]:
+    # text_stream: text đã trích xuất sẵn (vd các khoảng trang ghép lại theo thứ tự) thay vì đọc lại file
+    if text_stream is None:
+        text_stream = open_text_stream(path)
+        if text_stream is None:
+            return
+
+    doc_size = os.path.getsize(path)
+    for node in iter_nodes(text_stream, min_length=500, max_length=1500):
+        yield {
+            "text": node,
+            "doc_type": doc_type,
+            "metadata": {
+                "filename": path.name,
+                "doc_path": str(path),
+                "doc_size": doc_size,
                 "doc_type": doc_type,
-                "metadata": {
-                    "filename": path.name,
-                    "doc_path": str(path),
-                    "doc_size": os.path.getsize(path),
-                    "doc_type": doc_type,
-                }
-            } for node in nodes])
-    return documents
-
-def save_documents(docs: List[dict], out_dir: Path, basename: str, batch_size: int = 100) -> None:
+            }
+        }
+
+def extract_text_with_metadata(path: Path, doc_type: str) -> List[dict]:
+    return list(iter_documents(path, doc_type))
+
+def save_documents(docs: Iterable[dict], out_dir: Path, basename: str, batch_size: int = 100) -> int:
+    """
+    Ghi dần các node ra .txt/.jsonl (nhận cả generator) nên bộ nhớ chỉ giữ tối đa `batch_size` node.
+    Ghi vào file tạm rồi đổi tên; không có node nào thì giữ nguyên output cũ và trả 0.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
     txt_file = out_dir / f"{basename}.txt"
     jsonl_file = out_dir / f"{basename}.jsonl"
+    txt_tmp = out_dir / f"{basename}.txt.tmp"
+    jsonl_tmp = out_dir / f"{basename}.jsonl.tmp"
+
+    docs = iter(docs)
+    count = 0
+    try:
+        with open(txt_tmp, "w", encoding="utf-8") as txt_f, open(jsonl_tmp, "w", encoding="utf-8") as jsonl_f:
+            for batch in iter(lambda: list(islice(docs, batch_size)), []):
+                txt_f.write("\n\n".join(doc["text"] for doc in batch) + "\n\n")
+                jsonl_f.writelines(json.dumps(doc, ensure_ascii=False) + "\n" for doc in batch)
+                count += len(batch)
+    except BaseException:
+        txt_tmp.unlink(missing_ok=True)
+        jsonl_tmp.unlink(missing_ok=True)
+        raise
 
-    with open(txt_file, "w", encoding="utf-8") as txt_f, open(jsonl_file, "w", encoding="utf-8") as jsonl_f:
-        for i in range(0, len(docs), batch_size):
-            batch = docs[i:i + batch_size]
-            txt_f.write("\n\n".join(doc["text"] for doc in batch) + "\n\n")
-            jsonl_f.writelines(json.dumps(doc, ensure_ascii=False) + "\n" for doc in batch)
\ No newline at end of file
+    if not count:
+        txt_tmp.unlink()
+        jsonl_tmp.unlink()
+        return 0
+    os.replace(txt_tmp, txt_file)
+    os.replace(jsonl_tmp, jsonl_file)
+    return count
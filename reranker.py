@@ -0,0 +1,146 @@
+# reranker.py
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+
+class Reranker:
+    """
+    Rerank bằng CrossEncoder cho tập ứng viên lớn (~50) trong một ngân sách thời gian:
+    - chỉ chấm `max_candidates` ứng viên đứng đầu first-stage (lọc theo điểm nằm ở HybridRetriever,
+      trên cosine trước fusion);
+    - cache điểm theo (hash câu hỏi, node_id);
+    - chấm theo lô, dừng khi hết ngân sách, phần chưa chấm giữ thứ tự first-stage;
+    - tùy chọn lượng tử hóa động int8 cho CPU.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, batch_size: int = 16,
+                 max_candidates: int = 50,
+                 latency_budget_ms: Optional[float] = None, cache_size: int = 4096, model=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self.lock = threading.Lock()
+        # model: đối tượng có .predict(pairs, batch_size) đã load sẵn (vd model giả lập trong benchmark)
+        self.model = model if model is not None else load_cross_encoder(model_name, quantize)
+
+    def _cache_get(self, key):
+        with self.lock:
+            score = self.cache.get(key)
+            if score is not None:
+                self.cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key, score: float) -> None:
+        with self.lock:
+            self.cache[key] = score
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _prefilter(self, results: List[NodeWithScore]) -> List[NodeWithScore]:
+        return sorted(results, key=lambda r: r.score or 0.0, reverse=True)[:self.max_candidates]
+
+    def rerank(self, query: str, results: List[NodeWithScore]) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        candidates = self._prefilter(results)
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+        scores = {}
+        pending = []
+        for r in candidates:
+            cached = self._cache_get((query_hash, r.node.node_id))
+            if cached is not None:
+                scores[r.node.node_id] = cached
+            else:
+                pending.append(r)
+
+        for i in range(0, len(pending), self.batch_size):
+            if self.latency_budget_ms is not None and i > 0 \
+                    and (time.perf_counter() - start) * 1000 > self.latency_budget_ms:
+                break
+            batch = pending[i:i + self.batch_size]
+            batch_scores = self.model.predict([(query, r.node.get_content()) for r in batch],
+                                              batch_size=self.batch_size)
+            for r, score in zip(batch, batch_scores):
+                scores[r.node.node_id] = float(score)
+                self._cache_put((query_hash, r.node.node_id), float(score))
+
+        scored = [NodeWithScore(node=r.node, score=scores[r.node.node_id])
+                  for r in candidates if r.node.node_id in scores]
+        scored.sort(key=lambda r: r.score, reverse=True)
+        # Ứng viên chưa kịp chấm (hết ngân sách) xếp sau, giữ thứ tự first-stage
+        unscored = [r for r in candidates if r.node.node_id not in scores]
+        return scored + unscored
+
+def load_cross_encoder(model_name: str, quantize: bool = False):
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    if quantize:
+        # Lượng tử hóa động chỉ hỗ trợ CPU: các lớp Linear chạy int8, activation vẫn fp32
+        model = CrossEncoder(model_name, device="cpu")
+        model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+    return CrossEncoder(model_name)
+
+def _ranks(values: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values)] = np.arange(len(values))
+    return ranks
+
+def check_int8_parity(model_name: str, query_groups: List[tuple]) -> dict:
+    """
+    So sánh điểm CrossEncoder fp32 và int8 trên các nhóm (câu hỏi, [đoạn văn...]).
+    Trả về sai lệch tuyệt đối lớn nhất, tương quan Spearman trung bình và tỉ lệ trùng top-1.
+    """
+    from sentence_transformers import CrossEncoder
+
+    fp32 = CrossEncoder(model_name, device="cpu")
+    int8 = load_cross_encoder(model_name, quantize=True)
+    max_diff, spearman, top1 = 0.0, [], 0
+    for query, passages in query_groups:
+        pairs = [(query, p) for p in passages]
+        a = np.asarray(fp32.predict(pairs))
+        b = np.asarray(int8.predict(pairs))
+        max_diff = max(max_diff, float(np.abs(a - b).max()))
+        if len(passages) > 1:
+            spearman.append(float(np.corrcoef(_ranks(a), _ranks(b))[0, 1]))
+        top1 += int(a.argmax() == b.argmax())
+    return {
+        "max_abs_diff": max_diff,
+        "spearman": float(np.mean(spearman)) if spearman else 1.0,
+        "top1_agreement": top1 / len(query_groups),
+    }
+
+if __name__ == "__main__":
+    from config import Config
+
+    sample_groups = [
+        ("Quy trình triển khai thiết bị tại Datacenter gồm những bước nào?", [
+            "Đơn vị nội bộ gửi yêu cầu triển khai thiết bị, bộ phận vận hành kiểm tra vị trí rack và nguồn điện.",
+            "UPS Eaton 9130 hiển thị cảnh báo khi pin yếu, cần thay pin theo hướng dẫn của nhà sản xuất.",
+            "Quy hoạch rack tại Datacenter phải đảm bảo khoảng trống làm mát và phân bổ tải điện đều.",
+        ]),
+        ("How do I replace the battery on the Eaton 9130 UPS?", [
+            "Remove the front cover, disconnect the internal battery connector and slide the tray out.",
+            "The NX range cabinets must be anchored to the floor before installing equipment.",
+            "Thiết bị mới phải được dán nhãn và cập nhật vào hệ thống quản lý tài sản.",
+        ]),
+        ("Cách đấu nối cáp nguồn cho rack mới?", [
+            "Cáp nguồn được đấu vào PDU theo sơ đồ, mỗi thiết bị dùng hai nguồn từ hai PDU khác nhau.",
+            "Battery runtime depends on the connected load and battery age.",
+            "Nhân viên trực ca ghi nhận sự cố vào sổ vận hành và báo cáo trưởng ca.",
+        ]),
+    ]
+    report = check_int8_parity(Config.RERANK_MODEL, sample_groups)
+    print(f"🧪 Parity int8 vs fp32: {report}")
+    ok = report["top1_agreement"] == 1.0 and report["spearman"] >= 0.9
+    print("✅ Đạt" if ok else "❌ Không đạt: int8 làm lệch thứ hạng, không nên bật RERANK_INT8.")
+    raise SystemExit(0 if ok else 1)
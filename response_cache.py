@@ -0,0 +1,119 @@
+# response_cache.py
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+import numpy as np
+
+@dataclass
+class CacheEntry:
+    answer: str
+    context: str
+    node_id: str
+    node_hash: str
+    embedding: Optional[np.ndarray]
+    created: float = field(default_factory=time.time)
+
+class ResponseCache:
+    """
+    Cache câu trả lời đặt trước LLM, gồm 2 tầng:
+    - exact: khóa theo câu hỏi đã chuẩn hóa (NFC, chữ thường, gộp khoảng trắng);
+    - semantic: dùng lại câu trả lời khi embedding câu hỏi mới đủ gần (cosine ≥ ngưỡng)
+      và node tài liệu dùng để trả lời vẫn chưa thay đổi.
+    Loại bỏ theo LRU + TTL, tự xóa toàn bộ khi phiên bản index thay đổi.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95, version: str = ""):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version = version
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = unicodedata.normalize("NFC", query).lower().strip()
+        query = re.sub(r"[?!.\s]+$", "", query)
+        return re.sub(r"\s+", " ", query)
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def set_version(self, version: str) -> None:
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.created > self.ttl_seconds
+
+    def _valid(self, key: str, entry: CacheEntry, is_node_current: Optional[Callable]) -> bool:
+        if self._expired(entry) or (is_node_current and not is_node_current(entry.node_id, entry.node_hash)):
+            del self.entries[key]
+            return False
+        return True
+
+    def get(self, query: str, query_embedding=None,
+            is_node_current: Optional[Callable[[str, str], bool]] = None,
+            accept: Optional[Callable[[CacheEntry], bool]] = None) -> Optional[CacheEntry]:
+        # accept: lọc theo lượt hỏi (vd phân vùng), entry bị từ chối được bỏ qua chứ không bị xóa
+        key = self.normalize(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (accept is None or accept(entry)) and self._valid(key, entry, is_node_current):
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry
+
+            if query_embedding is not None and self.entries:
+                keys: List[str] = [k for k, e in self.entries.items() if e.embedding is not None]
+                if keys:
+                    matrix = np.stack([self.entries[k].embedding for k in keys])
+                    scores = matrix @ self._unit(query_embedding)
+                    # Duyệt từ gần nhất, bỏ qua entry hết hạn/node đã đổi
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.similarity_threshold:
+                            break
+                        cand_key = keys[i]
+                        if accept is not None and not accept(self.entries[cand_key]):
+                            continue
+                        if self._valid(cand_key, self.entries[cand_key], is_node_current):
+                            self.entries.move_to_end(cand_key)
+                            self.semantic_hits += 1
+                            return self.entries[cand_key]
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, answer: str, context: str, node_id: str, node_hash: str, query_embedding=None) -> None:
+        key = self.normalize(query)
+        embedding = self._unit(query_embedding) if query_embedding is not None else None
+        with self.lock:
+            self.entries[key] = CacheEntry(answer, context, node_id, node_hash, embedding)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
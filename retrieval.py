@@ -0,0 +1,108 @@
+# retrieval.py
+
+from collections import defaultdict
+from typing import List
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+from metrics import span
+
+RRF_K = 60  # hằng số làm mượt chuẩn của reciprocal rank fusion
+PARTITION_BOOST = 0.5  # mode "boost": điểm của node thuộc phân vùng được chọn nhân (1 + PARTITION_BOOST)
+
+def reciprocal_rank_fusion(result_lists: List[List[NodeWithScore]], k: int = RRF_K) -> List[NodeWithScore]:
+    scores = defaultdict(float)
+    nodes = {}
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            node_id = result.node.node_id
+            scores[node_id] += 1.0 / (k + rank + 1)
+            nodes.setdefault(node_id, result.node)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in ranked]
+
+class HybridRetriever:
+    """
+    Kết hợp kết quả dense (vector) và lexical (BM25) bằng reciprocal rank fusion,
+    giúp các truy vấn chứa mã thiết bị/quy trình ("qtdc10", "Eaton 9130") không bị bỏ sót.
+
+    Có thể giới hạn (restrict) hoặc ưu tiên (boost) một số phân vùng metadata `partition_key`
+    cho từng truy vấn; restrict cần `index` để dựng retriever có filter trên vector store.
+
+    Điểm RRF chỉ phản ánh thứ hạng (mọi ứng viên đều ≥ ~1/3 điểm cao nhất) nên không dùng để lọc được:
+    kết quả dense có cosine < `min_dense_ratio` × cosine tốt nhất bị bỏ ngay trước khi fusion,
+    giúp reranker không phải chấm các đoạn văn gần như không liên quan.
+    """
+
+    def __init__(self, dense_retriever, bm25, docstore, bm25_top_k: int = 10, fused_top_k: int = 5,
+                 index=None, dense_top_k: int = 10, partition_key: str = "doc_type",
+                 partition_boost: float = PARTITION_BOOST, min_dense_ratio: float = 0.0):
+        self.dense_retriever = dense_retriever
+        self.bm25 = bm25
+        self.docstore = docstore
+        self.bm25_top_k = bm25_top_k
+        self.fused_top_k = fused_top_k
+        self.index = index
+        self.dense_top_k = dense_top_k
+        self.partition_key = partition_key
+        self.partition_boost = partition_boost
+        self.min_dense_ratio = min_dense_ratio
+        self._restricted = {}  # tuple phân vùng → (dense retriever có filter, tập node_id cho BM25)
+
+    @property
+    def partitions(self) -> dict:
+        vector_store = getattr(self.index, "vector_store", None)
+        return getattr(vector_store, "partitions", {})
+
+    def _restricted_retrievers(self, partitions):
+        key = tuple(sorted(partitions))
+        if key not in self._restricted:
+            filters = MetadataFilters(filters=[MetadataFilter(key=self.partition_key, value=list(key),
+                                                              operator=FilterOperator.IN)])
+            dense = self.index.as_retriever(similarity_top_k=self.dense_top_k, filters=filters)
+            allowed = self.index.vector_store.partition_node_ids(key)
+            self._restricted[key] = (dense, allowed)
+        return self._restricted[key]
+
+    def _boost(self, results: List[NodeWithScore], partitions) -> List[NodeWithScore]:
+        for result in results:
+            if result.node.metadata.get(self.partition_key) in partitions:
+                result.score = (result.score or 0.0) * (1 + self.partition_boost)
+        return sorted(results, key=lambda r: r.score or 0.0, reverse=True)
+
+    def _cut_dense(self, results: List[NodeWithScore]) -> List[NodeWithScore]:
+        if not results or self.min_dense_ratio <= 0:
+            return results
+        best = max(r.score or 0.0 for r in results)
+        if best <= 0:
+            return results
+        return [r for r in results if (r.score or 0.0) >= best * self.min_dense_ratio]
+
+    def lexical_retrieve(self, query: str, allowed=None) -> List[NodeWithScore]:
+        if self.bm25 is None:
+            return []
+        hits = self.bm25.search(query, self.bm25_top_k, allowed=allowed)
+        results = []
+        for node_id, score in hits:
+            node = self.docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=score))
+        return results
+
+    def retrieve(self, query, trace=None, partitions=None, mode: str = "restrict") -> List[NodeWithScore]:
+        """partitions + mode="restrict": chỉ tìm trong các phân vùng đó; mode="boost": tìm toàn bộ, ưu tiên chúng."""
+        dense_retriever, allowed = self.dense_retriever, None
+        if partitions and mode == "restrict" and self.index is not None:
+            dense_retriever, allowed = self._restricted_retrievers(partitions)
+        with span(trace, "vector_retrieve"):
+            dense = self._cut_dense(dense_retriever.retrieve(query))
+        query_str = query if isinstance(query, str) else query.query_str
+        with span(trace, "bm25_retrieve"):
+            lexical = self.lexical_retrieve(query_str, allowed)
+        if not lexical:
+            results = dense
+        else:
+            with span(trace, "fusion"):
+                results = reciprocal_rank_fusion([dense, lexical])
+        if partitions and mode == "boost":
+            results = self._boost(results, set(partitions))
+        return results[:self.fused_top_k]
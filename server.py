@@ -0,0 +1,268 @@
+# server.py
+
+import json
+import asyncio
+from http import HTTPStatus
+from functools import partial
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from chatbot import IDCChatbot, get_hf_token
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+class Job:
+    def __init__(self, question, stream=False, partitions=None, mode=None, max_new_tokens=None):
+        self.question = question
+        self.stream = stream
+        self.partitions = partitions  # None → để query router tự chọn phân vùng
+        self.mode = mode
+        self.max_new_tokens = max_new_tokens
+        self.events = asyncio.Queue()  # (event, data) gửi về cho handler của kết nối
+        self.cancelled = False
+        self.turn = None  # gán sau prepare(), để hủy phần sinh khi client ngắt kết nối
+
+class ChatServer:
+    """
+    HTTP API bất đồng bộ (asyncio thuần, không cần framework) cho IDC chatbot:
+    - POST /query         {"question": "...", "partitions": ["manual"], "mode": "restrict"|"boost",
+                           "max_new_tokens": 128} → JSON
+    - POST /query/stream  {"question": "..."} → Server-Sent Events (context, token..., answer, done)
+    - GET  /health
+    - GET  /metrics       → độ trễ từng giai đoạn, định dạng Prometheus
+    Model chỉ load một lần. Các câu hỏi đi qua hàng đợi giới hạn; khi đầy trả 503 (backpressure).
+    Embed/retrieve/rerank chạy trên thread pool, sinh câu trả lời chạy trên executor LLM riêng;
+    với Config.GEN_BATCHING, các thread LLM cùng đẩy prompt vào GenerationScheduler để gom batch.
+    Hai tầng worker nối bằng hàng đợi thứ hai: worker prepare chuyển lượt hỏi đã retrieve sang
+    `llm_workers` worker sinh rồi nhận job kế tiếp ngay, nên số prompt đồng thời tới scheduler
+    không bị giới hạn bởi số worker prepare và câu trả lời dài không chặn retrieval của job sau.
+    """
+
+    def __init__(self, bot, queue_size=32, workers=4, llm_workers=1):
+        self.bot = bot
+        self.queue = None
+        self.queue_size = queue_size
+        self.workers = workers
+        self.llm_workers = llm_workers
+        self.generation_queue = None
+        self.cpu_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieve")
+        self.llm_executor = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm")
+
+    async def serve(self, host, port):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # Đầy khi mọi worker sinh đều bận → worker prepare chờ ở put() (backpressure về hàng đợi chính)
+        self.generation_queue = asyncio.Queue(maxsize=self.llm_workers)
+        for _ in range(self.workers):
+            asyncio.create_task(self.worker())
+        for _ in range(self.llm_workers):
+            asyncio.create_task(self.generation_worker())
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        print(f"🌐 IDC chatbot API đang chạy tại http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            handed_off = False
+            try:
+                if job.cancelled:
+                    continue
+                turn = await loop.run_in_executor(self.cpu_executor, partial(
+                    self.bot.prepare, job.question, partitions=job.partitions, mode=job.mode))
+                turn["max_new_tokens"] = job.max_new_tokens
+                job.turn = turn
+                await job.events.put(("context", {"context": turn["context"], "sources": turn["sources"],
+                                                  "cached": turn["cached"]}))
+                if turn["cached"] or turn.get("not_found"):
+                    # Đã có câu trả lời → không chiếm worker sinh
+                    await self.answer(self.cpu_executor, job)
+                else:
+                    await self.generation_queue.put(job)
+                    handed_off = True
+            except Exception as e:
+                await job.events.put(("error", {"error": repr(e)}))
+            finally:
+                if not handed_off:
+                    await job.events.put(("done", None))
+                self.queue.task_done()
+
+    async def generation_worker(self):
+        while True:
+            job = await self.generation_queue.get()
+            try:
+                await self.answer(self.llm_executor, job)
+            except Exception as e:
+                await job.events.put(("error", {"error": repr(e)}))
+            finally:
+                await job.events.put(("done", None))
+                self.generation_queue.task_done()
+
+    async def answer(self, executor, job):
+        loop = asyncio.get_running_loop()
+        turn = job.turn
+        if job.stream:
+            await loop.run_in_executor(executor, self.stream_tokens, loop, job, turn)
+        elif not job.cancelled:
+            turn = await loop.run_in_executor(executor, self.bot.generate, turn)
+        await job.events.put(("answer", {"answer": turn.get("answer", ""), "cached": turn["cached"]}))
+
+    def stream_tokens(self, loop, job, turn):
+        # Chạy trong thread của executor LLM → đẩy token về event loop một cách thread-safe
+        # closing → generator bị đóng ngay khi client ngắt, request trong scheduler được hủy
+        with closing(self.bot.generate_stream(turn)) as deltas:
+            for delta in deltas:
+                if job.cancelled:
+                    break
+                loop.call_soon_threadsafe(job.events.put_nowait, ("token", {"delta": delta}))
+
+    def cancel(self, job):
+        job.cancelled = True
+        if job.turn is not None:
+            self.bot.cancel(job.turn)
+
+    def submit(self, question, stream=False, partitions=None, mode=None, max_new_tokens=None):
+        job = Job(question, stream, partitions, mode, max_new_tokens)
+        self.queue.put_nowait(job)  # QueueFull → handler trả 503
+        return job
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, body = await read_request(reader)
+            if method == "GET" and path == "/health":
+                await send_json(writer, HTTPStatus.OK, {"status": "ok", "queued": self.queue.qsize()})
+            elif method == "GET" and path == "/metrics":
+                await send_text(writer, HTTPStatus.OK, self.bot.metrics.to_prometheus(),
+                                content_type="text/plain; version=0.0.4; charset=utf-8")
+            elif method == "POST" and path in ("/query", "/query/stream"):
+                await self.handle_query(reader, writer, body, stream=path.endswith("/stream"))
+            else:
+                await send_json(writer, HTTPStatus.NOT_FOUND, {"error": "not found"})
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_query(self, reader, writer, body, stream):
+        payload = json.loads(body or b"{}")
+        if not isinstance(payload, dict):
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "body phải là một JSON object"})
+            return
+        question = str(payload.get("question", "")).strip()
+        if not question:
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "thiếu 'question'"})
+            return
+        partitions = payload.get("partitions")
+        if partitions is not None and not isinstance(partitions, list):
+            partitions = [partitions]
+        if partitions is not None and not all(isinstance(p, str) for p in partitions):
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "'partitions' phải là chuỗi hoặc danh sách chuỗi"})
+            return
+        mode = payload.get("mode", "restrict" if partitions else None)
+        if mode not in (None, "restrict", "boost"):
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "'mode' phải là 'restrict' hoặc 'boost'"})
+            return
+        max_new_tokens = payload.get("max_new_tokens")
+        # bool là lớp con của int trong Python → true/false phải bị loại riêng
+        if max_new_tokens is not None and (not isinstance(max_new_tokens, int) or isinstance(max_new_tokens, bool)
+                                           or max_new_tokens <= 0):
+            await send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "'max_new_tokens' phải là số nguyên dương"})
+            return
+        try:
+            job = self.submit(question, stream, partitions, mode, max_new_tokens)
+        except asyncio.QueueFull:
+            await send_json(writer, HTTPStatus.SERVICE_UNAVAILABLE, {"error": "server đang quá tải"},
+                            headers={"Retry-After": "1"})
+            return
+
+        try:
+            if stream:
+                await self.stream_events(writer, job)
+            else:
+                result = {"question": question}
+                while True:
+                    event, data = await next_event(reader, job)
+                    if event == "done":
+                        break
+                    if event == "error":
+                        await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, data)
+                        return
+                    result.update(data)
+                await send_json(writer, HTTPStatus.OK, result)
+        except ConnectionError:
+            self.cancel(job)
+
+    async def stream_events(self, writer, job):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        await writer.drain()
+        while True:
+            event, data = await job.events.get()
+            payload = json.dumps(data, ensure_ascii=False) if data is not None else "{}"
+            writer.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            await writer.drain()
+            if event == "done":
+                break
+
+async def next_event(reader, job):
+    # Request đã đọc hết → reader trả EOF nghĩa là client đã đóng kết nối trong lúc chờ câu trả lời
+    get = asyncio.ensure_future(job.events.get())
+    eof = asyncio.ensure_future(reader.read(1))
+    done, _ = await asyncio.wait({get, eof}, return_when=asyncio.FIRST_COMPLETED)
+    eof.cancel()
+    if get not in done:
+        get.cancel()
+        raise ConnectionResetError("client đã ngắt kết nối")
+    return get.result()
+
+async def read_request(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3:
+        raise ValueError("request line không hợp lệ")
+    method, path, _ = parts
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("body quá lớn")
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], body
+
+async def send_json(writer, status, data, headers=None):
+    await send_text(writer, status, json.dumps(data, ensure_ascii=False), headers=headers)
+
+async def send_text(writer, status, text, content_type="application/json; charset=utf-8", headers=None):
+    body = text.encode("utf-8")
+    head = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+if __name__ == "__main__":
+    print("🤖 Đang load model cho IDC chatbot API...")
+    bot = IDCChatbot(get_hf_token())
+    # Nhận request ngay khi retrieval sẵn sàng; LLM/reranker tiếp tục load nền
+    bot.wait_until_retrieval_ready()
+    print(bot.startup_report())
+    server = ChatServer(bot, queue_size=Config.SERVER_QUEUE_SIZE, workers=Config.SERVER_WORKERS,
+                        llm_workers=Config.GEN_MAX_BATCH_SIZE if Config.GEN_BATCHING else 1)
+    asyncio.run(server.serve(Config.SERVER_HOST, Config.SERVER_PORT))
@@ -0,0 +1,107 @@
+# snapshots.py
+
+import os
+import time
+import uuid
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# data/storage/
+#   CURRENT                  ← tên snapshot đang phục vụ (ghi tmp + os.replace)
+#   snapshots/<version>/     ← docstore, vectors.npy, bm25... bất biến sau khi publish
+#   snapshots/<version>.tmp/ ← snapshot đang build, chưa ai đọc
+# Không có CURRENT → layout phẳng cũ (mọi file nằm thẳng trong data/storage)
+CURRENT_FNAME = "CURRENT"
+SNAPSHOTS_DIRNAME = "snapshots"
+STAGING_SUFFIX = ".tmp"
+STALE_STAGING_SECONDS = 3600  # thư mục .tmp cũ hơn mức này là do lần build bị ngắt → GC được xóa
+
+def current_version(root) -> Optional[str]:
+    path = Path(root) / CURRENT_FNAME
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8").strip() or None
+
+def resolve(root) -> Tuple[Path, Optional[str]]:
+    """Thư mục storage đang phục vụ và phiên bản snapshot của nó (None với layout phẳng cũ)."""
+    root = Path(root)
+    version = current_version(root)
+    if version is not None and (root / SNAPSHOTS_DIRNAME / version).is_dir():
+        return root / SNAPSHOTS_DIRNAME / version, version
+    return root, None
+
+def resolve_storage_dir(root) -> Path:
+    return resolve(root)[0]
+
+def begin_snapshot(root) -> Path:
+    # Tên bắt đầu bằng thời gian → sắp xếp theo tên cũng là theo thứ tự build
+    version = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:4]}"
+    staging = Path(root) / SNAPSHOTS_DIRNAME / f"{version}{STAGING_SUFFIX}"
+    staging.mkdir(parents=True)
+    return staging
+
+def publish_snapshot(root, staging) -> str:
+    staging = Path(staging)
+    version = staging.name[:-len(STAGING_SUFFIX)]
+    os.replace(staging, staging.with_name(version))
+    tmp = Path(root) / f"{CURRENT_FNAME}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, Path(root) / CURRENT_FNAME)
+    return version
+
+def remove_flat_layout(root) -> List[str]:
+    """
+    Xóa các file của layout phẳng cũ còn nằm thẳng trong root sau khi đã có snapshot được publish
+    (lần migrate đầu tiên): không còn ai đọc chúng nữa. Lỗi xóa chỉ bỏ qua như gc_snapshots.
+    """
+    root = Path(root)
+    if current_version(root) is None:
+        return []
+    keep = {CURRENT_FNAME, f"{CURRENT_FNAME}.tmp", SNAPSHOTS_DIRNAME}
+    removed = []
+    for path in root.iterdir():
+        if path.name in keep:
+            continue
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            removed.append(path.name)
+        except OSError as e:
+            print(f"⚠️ Chưa xóa được {path.name} của layout cũ: {e}")
+    return removed
+
+def list_snapshots(root) -> List[str]:
+    snapshots_dir = Path(root) / SNAPSHOTS_DIRNAME
+    if not snapshots_dir.exists():
+        return []
+    return sorted(p.name for p in snapshots_dir.iterdir() if p.is_dir() and not p.name.endswith(STAGING_SUFFIX))
+
+def gc_snapshots(root, keep: int = 3) -> List[str]:
+    """
+    Xóa snapshot cũ, giữ `keep` bản mới nhất (luôn giữ bản CURRENT): chatbot chưa kịp chuyển
+    vẫn đọc được bản trước đó. Lỗi xóa (vd file còn bị mmap trên Windows) chỉ bỏ qua, lần sau xóa tiếp.
+    """
+    root = Path(root)
+    current = current_version(root)
+    versions = list_snapshots(root)
+    stale = [v for v in (versions[:-keep] if keep > 0 else versions) if v != current]
+    snapshots_dir = root / SNAPSHOTS_DIRNAME
+    if snapshots_dir.exists():
+        stale += [p.name for p in snapshots_dir.iterdir()
+                  if p.is_dir() and p.name.endswith(STAGING_SUFFIX)
+                  and time.time() - p.stat().st_mtime > STALE_STAGING_SECONDS]
+    removed = []
+    for name in stale:
+        try:
+            shutil.rmtree(snapshots_dir / name)
+            removed.append(name)
+        except OSError as e:
+            print(f"⚠️ Chưa xóa được snapshot {name}: {e}")
+    return removed
@@ -12,12 +12,16 @@ def run_parallel_pipeline(
 ):
     """
     Chạy song song xử lý danh sách `items` với progress bar cập nhật theo thời gian thực.
+    Trả về list kết quả theo thứ tự hoàn thành (không theo thứ tự `items`).
     """
+    results = []
     with Pool(processes=max_processes) as pool:
         wrapped_func = partial(func, *shared_args)
         with tqdm(total=len(items), desc=desc, ncols=ncols) as pbar:
-            for _ in pool.imap_unordered(wrapped_func, items):
+            for result in pool.imap_unordered(wrapped_func, items):
+                results.append(result)
                 pbar.update(1)
+    return results
 
 def run_sequential_pipeline(
     items,
@@ -27,8 +31,7 @@ def run_sequential_pipeline(
     ncols=100
 ):
     """
-    Chạy tuần tự danh sách `items` với progress bar.
+    Chạy tuần tự danh sách `items` với progress bar. Trả về list kết quả theo thứ tự `items`.
     """
     wrapped_func = partial(func, *shared_args)
-    for item in tqdm(items, desc=desc, ncols=ncols):
-        wrapped_func(item)
+    return [wrapped_func(item) for item in tqdm(items, desc=desc, ncols=ncols)]